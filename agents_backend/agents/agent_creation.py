@@ -1,53 +1,322 @@
+import asyncio
+import math
 import ollama
 import logging
 import time
 import json
+from agents.errors import GenerationQueueFull
+from agents.json_parsing import IncrementalObjectParser, parse_json_object
+from db.generation_cache import GenerationCache, DEFAULT_GENERATION_CACHE_PATH
+from metrics import STAGE_LATENCY, GENERATION_FAILURES, log_sampled
+from config import (
+    OLLAMA_HOST,
+    OLLAMA_KEEP_ALIVE,
+    GENERATION_MAX_CONCURRENCY,
+    GENERATION_MAX_QUEUE,
+    GENERATION_TIMEOUT,
+    GENERATION_MAX_RETRIES,
+    GENERATION_RETRY_BUDGET_RATIO,
+    DECOMPOSITION_MAX_SUBAGENTS,
+    GENERATION_CACHE_ENABLED,
+    GENERATION_CACHE_PATH,
+    GENERATION_CACHE_MAX_ENTRIES,
+    GENERATION_CACHE_READ_ONLY
+)
+
+# Prompts are fixed system messages with the problem statement as the only variable part,
+# so every request shares the same prefix and Ollama can reuse its prompt cache.
+AGENT_SYSTEM_PROMPT = (
+    "You create one AI agent that can solve the user's problem statement. "
+    "Reply with a JSON object containing: role (short agent role), "
+    "role_description (detailed description of the role) and "
+    "task_prompt (specific instructions the agent will execute)."
+)
+
+DECOMPOSITION_SYSTEM_PROMPT = (
+    "You split the user's problem statement into at most {max_subagents} cooperating AI agents. "
+    "Reply with a JSON object {{\"subagents\": [...]}} where each subagent has: role (short, unique), "
+    "role_description, task_prompt, problem_statement (the sub-problem it solves) and "
+    "depends_on (roles of other subagents whose results it needs)."
+)
+
+# JSON schemas passed to Ollama's structured output (`format`).
+AGENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "role": {"type": "string"},
+        "role_description": {"type": "string"},
+        "task_prompt": {"type": "string"}
+    },
+    "required": ["role", "role_description", "task_prompt"]
+}
+
+DECOMPOSITION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "subagents": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "role": {"type": "string"},
+                    "role_description": {"type": "string"},
+                    "task_prompt": {"type": "string"},
+                    "problem_statement": {"type": "string"},
+                    "depends_on": {"type": "array", "items": {"type": "string"}}
+                },
+                "required": ["role", "role_description", "task_prompt", "problem_statement", "depends_on"]
+            }
+        }
+    },
+    "required": ["subagents"]
+}
+
+def render_messages(system_prompt, problem_statement):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"Problem statement: {problem_statement}"}
+    ]
+
+class GenerationScheduler:
+    """
+    Bounds LLM generations: at most `max_concurrency` run at once and at most
+    `max_queue` wait for a slot; beyond that callers get GenerationQueueFull.
+    Each call has a deadline (queue wait included) and is cancelled with its caller.
+    """
+    def __init__(self, max_concurrency, max_queue, timeout):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._avg_duration = 10.0    # Running estimate of one generation, in seconds.
+
+    def has_idle_slot(self):
+        return self.active + self.waiting < self.max_concurrency
+
+    def is_full(self):
+        return self.active + self.waiting >= self.max_concurrency + self.max_queue
+
+    def retry_after(self):
+        # Rough time until a queued request would get a slot.
+        backlog = self.waiting + 1
+        return max(1, math.ceil(self._avg_duration * backlog / self.max_concurrency))
+
+    async def run(self, func, *args):
+        if self.is_full():
+            raise GenerationQueueFull(self.retry_after())
+        # Counted before the first await so concurrent callers see each other.
+        self.waiting += 1
+        acquired = False
+        queued = time.perf_counter()
+
+        async def _run():
+            nonlocal acquired
+            await self._slots.acquire()
+            acquired = True
+            STAGE_LATENCY.observe(time.perf_counter() - queued, stage="generation_queue")
+            self.waiting -= 1
+            self.active += 1
+            started = time.monotonic()
+            try:
+                return await func(*args)
+            finally:
+                self.active -= 1
+                self._slots.release()
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * (time.monotonic() - started)
+
+        try:
+            return await asyncio.wait_for(_run(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            GENERATION_FAILURES.inc(kind="timeout")
+            raise
+        finally:
+            if not acquired:
+                self.waiting -= 1
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue
+        }
+
+class RetryBudget:
+    """
+    Caps retries at a fraction of first attempts: every attempt deposits `ratio`
+    tokens (up to `max_tokens`) and every retry spends one, so a failing model
+    cannot multiply the load on the generation pool.
+    """
+    def __init__(self, ratio, max_tokens=10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def record_attempt(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self):
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
 
 class AgentCreator:
     def __init__(self, model="llama3.2"):
         self.model = model         # Init with model.
+        self.client = ollama.AsyncClient(host=OLLAMA_HOST)
+        self.scheduler = GenerationScheduler(GENERATION_MAX_CONCURRENCY, GENERATION_MAX_QUEUE, GENERATION_TIMEOUT)
+        self.retry_budget = RetryBudget(GENERATION_RETRY_BUDGET_RATIO)
+        # Generation outcome counters.
+        self.stats = {"attempts": 0, "repaired": 0, "failures": 0, "retries": 0, "budget_exhausted": 0}
+        # Completed generations, replayed without calling the model.
+        self.generation_cache = None
+        if GENERATION_CACHE_ENABLED:
+            self.generation_cache = GenerationCache(
+                GENERATION_CACHE_PATH or DEFAULT_GENERATION_CACHE_PATH,
+                GENERATION_CACHE_MAX_ENTRIES,
+                GENERATION_CACHE_READ_ONLY
+            )
 
-    # Generate agent from problem statement.
-    def generate_agent(self, problem_statement):
-        prompt = f"""
-        You are an AI that generates structured agents in JSON format.
-        **Return ONLY JSON. No explanations or extra text.**
-        
-        **Task:**
-        - Create an agent that can solve the given problem.
-        - Provide a role and a detailed role description.
-        - Generate a specific task prompt for execution.
-        - Include metadata like creation timestamp and LLM used.
-
-        **JSON Format (Strict Schema):**
-        ```json
-        {{
-    "role": "<Agent Role>",
-    "role_description": "<Detailed agent role>",
-    "task_prompt": "<Task details>",
-    "parent_agent_id": "<ID of the parent agent (if applicable)>",
-    "creation_timestamp": "<Unix timestamp>",
-    "llm_used": "Llama 3.1"
-        }}
-        ```
-        
-        **Problem Statement:** "{problem_statement}"
-        
-        **Now, generate ONLY JSON output.**
-        """
+    async def warm_up(self):
+        # An empty chat makes Ollama load the model and keep it resident for keep_alive.
+        await self.client.chat(model=self.model, messages=[], keep_alive=OLLAMA_KEEP_ALIVE)
 
-        try:
-            response = ollama.chat(model=self.model, messages=[{"role": "user", "content": prompt}])
-            raw_text = response['message']['content'].strip()
-            logging.debug("Raw response from Ollama: %s", raw_text)
+    # Generate agent from problem statement, through the bounded scheduler.
+    # Raises GenerationQueueFull when overloaded and asyncio.TimeoutError past the deadline.
+    # With on_field, the response is streamed and on_field(name, value) is called as each field completes;
+    # on_field(None, attempt) before a retry means the fields received so far are void.
+    # Cached generations are returned without going through the scheduler.
+    async def generate_agent(self, problem_statement, on_field=None):
+        messages = render_messages(AGENT_SYSTEM_PROMPT, problem_statement)
+        cached = await self._cached(messages, AGENT_SCHEMA)
+        if cached is not None:
+            if on_field is not None:
+                for name, value in cached.items():
+                    await on_field(name, value)
+            return self._finish_agent(cached)
+        return await self.scheduler.run(self._generate_agent, messages, on_field)
+
+    async def _generate_agent(self, messages, on_field=None):
+        agent = await self._generate_json(messages, AGENT_SCHEMA, _is_valid_agent, on_field)
+        if agent is None:
+            return None
+        return self._finish_agent(agent)
+
+    def _finish_agent(self, agent):
+        # Set timestamp and model.
+        agent["creation_timestamp"] = int(time.time())
+        agent["llm_used"] = self.model
+        return agent
 
-            agent = json.loads(raw_text)
-            # Set timestamp and model.
-            agent["creation_timestamp"] = int(time.time())
+    # Decompose a problem into several subagents with dependencies, in a single generation.
+    async def decompose_problem(self, problem_statement):
+        messages = render_messages(
+            DECOMPOSITION_SYSTEM_PROMPT.format(max_subagents=DECOMPOSITION_MAX_SUBAGENTS), problem_statement
+        )
+        cached = await self._cached(messages, DECOMPOSITION_SCHEMA)
+        if cached is not None:
+            return self._finish_decomposition(cached)
+        return await self.scheduler.run(self._decompose_problem, messages)
+
+    async def _decompose_problem(self, messages):
+        result = await self._generate_json(
+            messages,
+            DECOMPOSITION_SCHEMA,
+            lambda value: any(_is_valid_agent(agent) for agent in value.get("subagents") or [])
+        )
+        if result is None:
+            return None
+        return self._finish_decomposition(result)
+
+    def _finish_decomposition(self, result):
+        subagents = [agent for agent in result["subagents"] if _is_valid_agent(agent)]
+        subagents = subagents[:DECOMPOSITION_MAX_SUBAGENTS]
+        now = int(time.time())
+        for agent in subagents:
+            agent.setdefault("problem_statement", agent.get("task_prompt", ""))
+            agent["creation_timestamp"] = now
             agent["llm_used"] = self.model
+        return subagents
 
-            return agent
+    async def _generate_json(self, messages, schema, is_valid, on_field=None):
+        """
+        Run a schema-constrained chat and parse the reply, repairing it if needed.
+        Failed attempts are retried up to GENERATION_MAX_RETRIES times while the
+        retry budget allows; returns None once attempts are exhausted.
+        """
+        retries = 0
+        while True:
+            self.stats["attempts"] += 1
+            if retries == 0:
+                self.retry_budget.record_attempt()
+            try:
+                with STAGE_LATENCY.time(stage="llm_call"):
+                    raw_text = (await self._chat(messages, schema, on_field)).strip()
+                log_sampled("Raw response from Ollama: %s", raw_text)
+                try:
+                    value = json.loads(raw_text)
+                except ValueError:
+                    value = parse_json_object(raw_text, schema.get("required", ()))
+                    self.stats["repaired"] += 1
+                if isinstance(value, dict) and is_valid(value):
+                    if self.generation_cache is not None:
+                        await self.generation_cache.run_in_executor(
+                            self.generation_cache.put, self._cache_key(messages, schema), self.model, value
+                        )
+                    return value
+                GENERATION_FAILURES.inc(kind="invalid_schema")
+                logging.warning("Model response did not match the expected schema: %s", raw_text[:200])
+            except Exception as e:
+                # Unrecoverable JSON, Ollama errors and connection failures are all retried.
+                GENERATION_FAILURES.inc(kind="unparseable" if isinstance(e, ValueError) else "model_error")
+                logging.error("Error generating agent from model: %s", str(e), exc_info=True)
+
+            self.stats["failures"] += 1
+            if retries >= GENERATION_MAX_RETRIES:
+                return None
+            if not self.retry_budget.try_spend():
+                self.stats["budget_exhausted"] += 1
+                return None
+            retries += 1
+            self.stats["retries"] += 1
+            if on_field is not None:
+                await on_field(None, retries)
 
-        except Exception as e:
-            logging.error("Error generating agent from model: %s", str(e), exc_info=True)
+    async def _cached(self, messages, schema):
+        # A previously validated reply to the same model, messages and options, or None.
+        if self.generation_cache is None:
             return None
+        return await self.generation_cache.run_in_executor(self.generation_cache.get, self._cache_key(messages, schema))
+
+    def _cache_key(self, messages, schema):
+        # keep_alive does not affect the reply, so only the format is part of the options.
+        return GenerationCache.key(self.model, messages, {"format": schema})
+
+    def close(self):
+        if self.generation_cache is not None:
+            self.generation_cache.close()
+
+    async def _chat(self, messages, schema, on_field=None):
+        options = {"model": self.model, "messages": messages, "format": schema, "keep_alive": OLLAMA_KEEP_ALIVE}
+        if on_field is None:
+            response = await self.client.chat(**options)
+            return response['message']['content']
+        return await self._stream_chat(options, on_field)
+
+    async def _stream_chat(self, options, on_field):
+        # Stream the completion, reporting top-level fields as soon as they are complete.
+        parser = IncrementalObjectParser()
+        async for part in await self.client.chat(stream=True, **options):
+            for name, value in parser.feed(part['message']['content']):
+                await on_field(name, value)
+        return parser.text
+
+
+def _is_valid_agent(agent):
+    return isinstance(agent, dict) and all(
+        isinstance(agent.get(field), str) and agent[field].strip()
+        for field in ("role", "role_description", "task_prompt")
+    )
@@ -0,0 +1,7 @@
+# Kept free of heavy imports so main.py can catch these without loading the LLM client.
+
+class GenerationQueueFull(Exception):
+    """Raised when every generation slot is busy and the wait queue is full."""
+    def __init__(self, retry_after):
+        super().__init__(f"Generation queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
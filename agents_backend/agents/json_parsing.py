@@ -0,0 +1,143 @@
+import json
+
+class IncrementalObjectParser:
+    """
+    Incremental parser for a streamed JSON object.
+    feed() takes text chunks as they arrive and returns the (key, value) pairs of
+    the top-level object that became complete, so fields can be used before the
+    whole object has been generated. Text before the opening brace is ignored.
+    """
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = "key"     # key -> key_string -> colon -> value
+        self._key = None
+        self._key_start = 0
+        self._value_start = 0
+        self.done = False
+
+    def feed(self, chunk):
+        self.text += chunk
+        fields = []
+        text = self.text
+        while self._pos < len(text) and not self.done:
+            ch = text[self._pos]
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._expect = "key"
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect == "key_string":
+                        self._key = json.loads(text[self._key_start:self._pos + 1])
+                        self._expect = "colon"
+            elif ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect == "key":
+                    self._key_start = self._pos
+                    self._expect = "key_string"
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 1:
+                    self._emit(text, fields)
+                    self.done = True
+                self._depth -= 1
+            elif self._depth == 1 and ch == ":" and self._expect == "colon":
+                self._expect = "value"
+                self._value_start = self._pos + 1
+            elif self._depth == 1 and ch == ",":
+                self._emit(text, fields)
+                self._expect = "key"
+            self._pos += 1
+        return fields
+
+    def _emit(self, text, fields):
+        if self._expect != "value":
+            return
+        raw = text[self._value_start:self._pos].strip()
+        try:
+            fields.append((self._key, json.loads(raw)))
+        except ValueError:
+            pass    # Malformed value; the caller still sees the full text at the end.
+
+
+def parse_json_object(text, required=()):
+    """
+    Parse a model response as a JSON object, tolerating markdown fences, text
+    around the object and trailing commas. A truncated object is cut back to its
+    last complete top-level field and only accepted when every `required` field
+    survives, so a half-written value is never returned. Raises ValueError when
+    no usable object can be recovered.
+    """
+    try:
+        value = json.loads(text)
+        if isinstance(value, dict):
+            return value
+    except ValueError:
+        pass
+
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("No JSON object found in model response")
+
+    # Scan to the matching brace, remembering which commas (outside strings) directly
+    # precede a closing bracket and where the last complete top-level field ends.
+    stack = []
+    in_string = escape = False
+    end = len(text)
+    last = None     # Index of the last non-whitespace character outside strings.
+    field_end = None    # Index of the last top-level comma.
+    trailing_commas = set()
+    for index in range(start, len(text)):
+        ch = text[index]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+                last = index
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if last is not None and text[last] == ",":
+                trailing_commas.add(last)
+            if stack:
+                stack.pop()
+            if not stack:
+                end = index + 1
+                break
+        elif ch == "," and len(stack) == 1:
+            field_end = index
+        if not ch.isspace():
+            last = index
+
+    truncated = bool(stack)
+    if truncated:
+        # Everything after the last top-level comma may be cut off mid-value (or be a
+        # dangling key), so keep only the fields before it.
+        end = field_end if field_end is not None else start + 1
+    candidate = "".join(ch for index, ch in enumerate(text[start:end], start) if index not in trailing_commas)
+    if truncated:
+        candidate += "}"
+    value = json.loads(candidate)
+    if not isinstance(value, dict):
+        raise ValueError("Model response is not a JSON object")
+    if truncated:
+        missing = [key for key in required if key not in value]
+        if missing:
+            raise ValueError(f"Model response was truncated before {', '.join(missing)} was complete")
+    return value
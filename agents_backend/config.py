@@ -7,3 +7,145 @@ load_dotenv()
 NEO4J_URI = os.getenv("NEO4J_URI")
 NEO4J_USER = os.getenv("NEO4J_USER")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
+
+# Neo4j driver connection pool, per process: maximum connections, how long (seconds) a
+# query waits for a free one, and how long a connection is reused before being replaced.
+NEO4J_MAX_CONNECTION_POOL_SIZE = int(os.getenv("NEO4J_MAX_CONNECTION_POOL_SIZE", "100"))
+NEO4J_CONNECTION_ACQUISITION_TIMEOUT = float(os.getenv("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", "60"))
+NEO4J_MAX_CONNECTION_LIFETIME = float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "3600"))
+
+# ChromaDB backend: "embedded" (a local directory, single process) or "http" (a Chroma
+# server shared by every worker and replica).
+CHROMA_MODE = os.getenv("CHROMA_MODE", "embedded").lower()
+CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+CHROMA_SSL = os.getenv("CHROMA_SSL", "false").lower() == "true"
+
+# ChromaDB persistence directory in embedded mode (defaults to db/chroma_db).
+CHROMA_PATH = os.getenv("CHROMA_PATH")
+
+# What ChromaDB stores per agent: "full" (every agent field as metadata, plus the embedded
+# text as the document) or "compact" (id, embedding and a few small filterable fields;
+# matches are hydrated from Neo4j). Existing collections are shrunk with
+# `python -m db.chroma_db compact`.
+CHROMA_RECORD_MODE = os.getenv("CHROMA_RECORD_MODE", "full").lower()
+
+# Tree-scoped lookups: "off" (every lookup searches the whole registry) or "tree" (each
+# agent is tagged with the root of the hierarchy it was created in, and lookups only
+# search the requesting parent's tree). With PARTITION_FALLBACK_GLOBAL, a statement with
+# no match in its tree is searched globally. Roots are cached per worker, and with an
+# in-memory vector index at most PARTITION_INDEX_CACHE_SIZE partitions stay loaded.
+VECTOR_PARTITIONING = os.getenv("VECTOR_PARTITIONING", "off").lower()
+PARTITION_FALLBACK_GLOBAL = os.getenv("PARTITION_FALLBACK_GLOBAL", "false").lower() == "true"
+PARTITION_ROOT_CACHE_SIZE = int(os.getenv("PARTITION_ROOT_CACHE_SIZE", "10000"))
+PARTITION_INDEX_CACHE_SIZE = int(os.getenv("PARTITION_INDEX_CACHE_SIZE", "16"))
+
+# Number of worker threads used for blocking ChromaDB calls.
+CHROMA_EXECUTOR_WORKERS = int(os.getenv("CHROMA_EXECUTOR_WORKERS", "4"))
+
+# Ollama server address (defaults to the local Ollama instance).
+OLLAMA_HOST = os.getenv("OLLAMA_HOST")
+
+# Maximum number of problem statements accepted by /submit_problems/.
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "500"))
+
+# Create Neo4j constraints/indexes on startup.
+NEO4J_SCHEMA_BOOTSTRAP = os.getenv("NEO4J_SCHEMA_BOOTSTRAP", "true").lower() == "true"
+
+# Also coalesce in-flight requests whose statements are semantically similar (costs one embedding per request).
+SINGLE_FLIGHT_SEMANTIC = os.getenv("SINGLE_FLIGHT_SEMANTIC", "false").lower() == "true"
+
+# Lookup cache in front of ChromaDB (size 0 disables it); TTLs in seconds.
+LOOKUP_CACHE_SIZE = int(os.getenv("LOOKUP_CACHE_SIZE", "10000"))
+LOOKUP_CACHE_TTL = float(os.getenv("LOOKUP_CACHE_TTL", "300"))
+LOOKUP_CACHE_NEGATIVE_TTL = float(os.getenv("LOOKUP_CACHE_NEGATIVE_TTL", "5"))
+
+# On-disk embedding cache (defaults to db/embedding_cache.sqlite3).
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+
+# Index new agents by their problem-statement embedding (already computed by the lookup)
+# instead of embedding role_description + task_prompt a second time.
+INDEX_PROBLEM_EMBEDDING = os.getenv("INDEX_PROBLEM_EMBEDDING", "false").lower() == "true"
+
+# In-memory mirror of the agents collection for matching: off, flat, hnsw or auto.
+VECTOR_INDEX_MODE = os.getenv("VECTOR_INDEX_MODE", "off").lower()
+# Registry size from which "auto" switches from the flat matrix to HNSW.
+VECTOR_INDEX_HNSW_THRESHOLD = int(os.getenv("VECTOR_INDEX_HNSW_THRESHOLD", "50000"))
+
+# LLM generation scheduler: concurrent generations, queued requests beyond that,
+# and the per-request deadline (seconds, queue wait included).
+GENERATION_MAX_CONCURRENCY = int(os.getenv("GENERATION_MAX_CONCURRENCY", "2"))
+GENERATION_MAX_QUEUE = int(os.getenv("GENERATION_MAX_QUEUE", "16"))
+GENERATION_TIMEOUT = float(os.getenv("GENERATION_TIMEOUT", "120"))
+
+# How often (seconds) a pending request checks whether its client has disconnected.
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+# Speculative generation: on a lookup-cache miss, start the LLM generation alongside the
+# registry lookup and cancel it if the lookup finds a match. Only idle generation slots
+# are used, and at most SPECULATIVE_MAX_IN_FLIGHT speculative generations run at once.
+SPECULATIVE_GENERATION = os.getenv("SPECULATIVE_GENERATION", "false").lower() == "true"
+SPECULATIVE_MAX_IN_FLIGHT = int(os.getenv("SPECULATIVE_MAX_IN_FLIGHT", "1"))
+
+# On-disk cache of completed generations, keyed by model, rendered prompt and options
+# (defaults to db/generation_cache.sqlite3), bounded to GENERATION_CACHE_MAX_ENTRIES with
+# LRU eviction. A read-only cache serves hits without storing or touching entries.
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "false").lower() == "true"
+GENERATION_CACHE_PATH = os.getenv("GENERATION_CACHE_PATH")
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "100000"))
+GENERATION_CACHE_READ_ONLY = os.getenv("GENERATION_CACHE_READ_ONLY", "false").lower() == "true"
+
+# Upper bound on subagents produced by one decomposition.
+DECOMPOSITION_MAX_SUBAGENTS = int(os.getenv("DECOMPOSITION_MAX_SUBAGENTS", "8"))
+
+# How long Ollama keeps the model loaded between requests (Ollama duration string, or -1 for forever).
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+if OLLAMA_KEEP_ALIVE.lstrip("-").isdigit():
+    OLLAMA_KEEP_ALIVE = int(OLLAMA_KEEP_ALIVE)
+
+# Retries after an unusable generation, per call, and the retry budget as a
+# fraction of first attempts across all calls.
+GENERATION_MAX_RETRIES = int(os.getenv("GENERATION_MAX_RETRIES", "2"))
+GENERATION_RETRY_BUDGET_RATIO = float(os.getenv("GENERATION_RETRY_BUDGET_RATIO", "0.2"))
+
+# Root log level, and the fraction of requests whose raw payloads (query results,
+# model responses) are logged at DEBUG level.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+DEBUG_LOG_SAMPLE_RATE = float(os.getenv("DEBUG_LOG_SAMPLE_RATE", "0.01"))
+
+# How new agents reach ChromaDB: "outbox" (durable queue drained by a background
+# indexer; responses return after the graph commit) or "sync" (inline write).
+INDEXING_MODE = os.getenv("INDEXING_MODE", "outbox").lower()
+# Outbox file (defaults to db/index_outbox.sqlite3).
+OUTBOX_PATH = os.getenv("OUTBOX_PATH")
+# Indexer batch size, how long to wait for a batch to fill and how often to poll
+# for retries (seconds).
+INDEXER_BATCH_SIZE = int(os.getenv("INDEXER_BATCH_SIZE", "64"))
+INDEXER_LINGER = float(os.getenv("INDEXER_LINGER", "0.05"))
+INDEXER_POLL_INTERVAL = float(os.getenv("INDEXER_POLL_INTERVAL", "1"))
+# Outbox entries whose agent is still missing from the graph after this many seconds are dropped.
+OUTBOX_ORPHAN_AGE = float(os.getenv("OUTBOX_ORPHAN_AGE", "60"))
+# Seconds between graph/vector reconciliation runs (0 disables).
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "3600"))
+
+# Read APIs: default and maximum page size, and the deepest subtree traversal allowed.
+READ_PAGE_SIZE = int(os.getenv("READ_PAGE_SIZE", "100"))
+READ_MAX_PAGE_SIZE = int(os.getenv("READ_MAX_PAGE_SIZE", "1000"))
+SUBTREE_MAX_DEPTH = int(os.getenv("SUBTREE_MAX_DEPTH", "10"))
+
+# Preload the embedding and Ollama models on startup (/ready reports the service
+# ready once Neo4j, the vector index and, with this on, the models are loaded).
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+# Seconds between warm-up attempts while a required dependency is unavailable.
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "5"))
+
+# Seconds between checks of the registry version stamp in Neo4j; when another worker has
+# indexed or deleted agents, this worker's lookup cache and vector index are brought up to date (0 disables).
+REGISTRY_SYNC_INTERVAL = float(os.getenv("REGISTRY_SYNC_INTERVAL", "2"))
+
+# Near-duplicate compaction: agents whose embeddings are within this squared L2 distance
+# of each other (much stricter than the 0.85 match threshold) are merged, and the number
+# of rows compared per block of the pairwise distance computation.
+COMPACTION_DISTANCE_THRESHOLD = float(os.getenv("COMPACTION_DISTANCE_THRESHOLD", "0.1"))
+COMPACTION_BLOCK_SIZE = int(os.getenv("COMPACTION_BLOCK_SIZE", "2048"))
@@ -1,16 +1,171 @@
+import argparse
+import asyncio
+import functools
 import logging
 import json
 import chromadb
 import os 
+import threading
+from collections import OrderedDict
+from chromadb.utils import embedding_functions
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    CHROMA_MODE,
+    CHROMA_HOST,
+    CHROMA_PORT,
+    CHROMA_SSL,
+    CHROMA_PATH,
+    CHROMA_RECORD_MODE,
+    CHROMA_EXECUTOR_WORKERS,
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_PATH,
+    INDEX_PROBLEM_EMBEDDING,
+    LOOKUP_CACHE_SIZE,
+    LOOKUP_CACHE_TTL,
+    LOOKUP_CACHE_NEGATIVE_TTL,
+    VECTOR_INDEX_MODE,
+    VECTOR_INDEX_HNSW_THRESHOLD,
+    VECTOR_PARTITIONING,
+    PARTITION_FALLBACK_GLOBAL,
+    PARTITION_INDEX_CACHE_SIZE
+)
+from db.embedding_cache import CachedEmbeddingFunction, embedding_namespace
+from db.lookup_cache import LookupCache, MISS
+from db.vector_index import create_vector_index, load_index_from_collection, match_fields
+from metrics import STAGE_LATENCY, MATCH_DISTANCE, log_sampled
+
+# Maximum distance at which an existing agent is reused (less strict than the original 0.7).
+SIMILARITY_THRESHOLD = 0.85
+
+# Metadata kept by compact records: small fields that are useful as query filters.
+COMPACT_FIELDS = ("role", "llm_used", "creation_timestamp", "partition")
+
+def compact_metadata(metadata):
+    return {field: metadata[field] for field in COMPACT_FIELDS if field in metadata}
+
+def normalize_statement(statement):
+    # Case- and whitespace-insensitive key for a problem statement.
+    return " ".join(statement.lower().split())
+
+def cache_key(statement, partition=None):
+    # Lookup cache key: partitioned lookups are cached per tree.
+    key = normalize_statement(statement)
+    return key if partition is None else f"{partition}\0{key}"
+
+def embedding_distance(a, b):
+    # Squared L2 distance, the metric of the collection's default "l2" space.
+    return sum((x - y) ** 2 for x, y in zip(a, b))
+
 class ChromaDBManager:
-    def __init__(self):
-        # Use the path relative to the db directory
-        db_path = os.path.join(os.path.dirname(__file__), "chroma_db")
-        logging.info(f"Initializing ChromaDB with path: {db_path}")
-        
-        self.chroma_client = chromadb.PersistentClient(path=db_path)
+    def __init__(self, embedding_function=None, path=None):
+        if CHROMA_MODE == "http" and path is None:
+            # A Chroma server shared by all workers; each worker keeps only its caches and index mirror.
+            logging.info(f"Connecting to ChromaDB server at {CHROMA_HOST}:{CHROMA_PORT}")
+            self.chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=CHROMA_SSL)
+        else:
+            # Use the path relative to the db directory unless configured
+            db_path = path or CHROMA_PATH or os.path.join(os.path.dirname(__file__), "chroma_db")
+            logging.info(f"Initializing ChromaDB with path: {db_path}")
+            self.chroma_client = chromadb.PersistentClient(path=db_path)
         self.agents_collection = self.chroma_client.get_or_create_collection(name="agents")
 
+        # Embeddings are computed here (not by the collection) so they can be cached and reused.
+        self.embedding_function = embedding_function or embedding_functions.DefaultEmbeddingFunction()
+        if EMBEDDING_CACHE_ENABLED:
+            self.embedding_function = CachedEmbeddingFunction(
+                self.embedding_function,
+                EMBEDDING_CACHE_PATH or os.path.join(os.path.dirname(__file__), "embedding_cache.sqlite3"),
+                namespace=embedding_namespace(self.embedding_function)
+            )
+
+        # Optional in-process mirror of the collection; Chroma stays the durable store.
+        # Built by load_vector_index() (part of warm-up); queries go to Chroma until then.
+        self.vector_index = None
+        # With VECTOR_PARTITIONING=tree the mirror is kept per partition instead: loaded on
+        # first use, least recently used partitions evicted.
+        self.partition_indexes = OrderedDict()
+        self._partition_lock = threading.Lock()
+
+        self.lookup_cache = LookupCache(LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL, LOOKUP_CACHE_NEGATIVE_TTL)
+
+        # Chroma's client is synchronous; calls are pushed onto this bounded pool from async code.
+        self.executor = ThreadPoolExecutor(
+            max_workers=CHROMA_EXECUTOR_WORKERS,
+            thread_name_prefix="chroma"
+        )
+
+    def load_vector_index(self):
+        # Warm-load the in-memory mirror from the collection (no-op when disabled or already loaded).
+        if self.vector_index is not None or VECTOR_PARTITIONING == "tree":
+            return
+        index = create_vector_index(VECTOR_INDEX_MODE, self.agents_collection.count(), VECTOR_INDEX_HNSW_THRESHOLD)
+        if index is not None:
+            load_index_from_collection(index, self.agents_collection)
+            self.vector_index = index
+
+    def reload_vector_index(self):
+        # Rebuild the mirror from the collection (after agents were deleted elsewhere) and swap it in.
+        with self._partition_lock:
+            self.partition_indexes.clear()    # Reloaded on next use.
+        if self.vector_index is None:
+            return
+        index = create_vector_index(VECTOR_INDEX_MODE, self.agents_collection.count(), VECTOR_INDEX_HNSW_THRESHOLD)
+        load_index_from_collection(index, self.agents_collection)
+        self.vector_index = index
+
+    def _partition_index(self, partition):
+        # The in-memory index of one partition, loaded from the collection on first use.
+        # Loads and mirror updates share the lock, so no agent stored meanwhile is missed.
+        with self._partition_lock:
+            index = self.partition_indexes.get(partition)
+            if index is not None:
+                self.partition_indexes.move_to_end(partition)
+                return index
+            index = create_vector_index(VECTOR_INDEX_MODE, 0, VECTOR_INDEX_HNSW_THRESHOLD)
+            if index is None:
+                return None
+            load_index_from_collection(index, self.agents_collection, where={"partition": partition})
+            self.partition_indexes[partition] = index
+            while len(self.partition_indexes) > PARTITION_INDEX_CACHE_SIZE:
+                self.partition_indexes.popitem(last=False)
+            return index
+
+    def _mirror_add(self, ids, embeddings, metadatas):
+        # Keep the in-memory mirror (global or loaded partitions) in step with the collection.
+        if self.vector_index is not None:
+            self.vector_index.add(ids, embeddings, [match_fields(metadata) for metadata in metadatas])
+        if self.partition_indexes:
+            with self._partition_lock:
+                for element_id, embedding, metadata in zip(ids, embeddings, metadatas):
+                    index = self.partition_indexes.get(metadata.get("partition"))
+                    if index is not None:
+                        index.add([element_id], [embedding], [match_fields(metadata)])
+
+    def load_embedding_model(self):
+        # The first embedding call loads the model; bypass the cache so it really runs.
+        embedding_function = self.embedding_function
+        if isinstance(embedding_function, CachedEmbeddingFunction):
+            embedding_function = embedding_function.embedding_function
+        embedding_function(["warm up"])
+
+    async def run_in_executor(self, func, *args, **kwargs):
+        # Run a blocking Chroma call without stalling the event loop.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def embed(self, texts):
+        # Embed texts in one batched call to the (cached) embedding function.
+        texts = list(texts)
+        if not texts:
+            return []
+        with STAGE_LATENCY.time(stage="embedding"):
+            return [list(map(float, vector)) for vector in self.embedding_function(texts)]
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        if isinstance(self.embedding_function, CachedEmbeddingFunction):
+            self.embedding_function.close()
+
     def sanitize_metadata(self, value):
         # Convert metadata to a supported type.
         if isinstance(value, (str, int, float, bool)):
@@ -19,67 +174,280 @@ class ChromaDBManager:
             return json.dumps(value)
         return str(value)
 
+    def build_record(self, agent_data):
+        # Build the (id, document, metadata) triple stored for an agent (compact records
+        # keep only COMPACT_FIELDS; the document is still the text that gets embedded).
+        metadata = {
+            "elementId": self.sanitize_metadata(agent_data.get("elementId", "")),
+            "problem_statement": self.sanitize_metadata(agent_data.get("problem_statement", "")),
+            "role": self.sanitize_metadata(agent_data.get("role", "Undefined Role")),
+            "role_description": self.sanitize_metadata(agent_data.get("role_description", "")),
+            "task_prompt": self.sanitize_metadata(agent_data.get("task_prompt", "")),
+            "creation_timestamp": self.sanitize_metadata(agent_data.get("creation_timestamp", 0)),
+            "llm_used": self.sanitize_metadata(agent_data.get("llm_used", "Unknown"))
+        }
+        if agent_data.get("partition"):
+            metadata["partition"] = self.sanitize_metadata(agent_data["partition"])
+
+        description_text = (
+            agent_data.get("role_description", "") + " " +
+            self.sanitize_metadata(agent_data.get("task_prompt", ""))
+        )
+        if CHROMA_RECORD_MODE == "compact":
+            metadata = compact_metadata(metadata)
+        return agent_data["elementId"], description_text, metadata
+
      # Store agent data in ChromaDB.
     def store_agent(self, agent_data):
-        elementId = agent_data["elementId"]
-        try:
-            metadata = {
-                "elementId": self.sanitize_metadata(agent_data.get("elementId", "")),
-                "problem_statement": self.sanitize_metadata(agent_data.get("problem_statement", "")),
-                "role": self.sanitize_metadata(agent_data.get("role", "Undefined Role")),
-                "role_description": self.sanitize_metadata(agent_data.get("role_description", "")),
-                "task_prompt": self.sanitize_metadata(agent_data.get("task_prompt", "")),
-                "creation_timestamp": self.sanitize_metadata(agent_data.get("creation_timestamp", 0)),
-                "llm_used": self.sanitize_metadata(agent_data.get("llm_used", "Unknown"))
-            }
-
-            description_text = (
-                agent_data.get("role_description", "") + " " +
-                self.sanitize_metadata(agent_data.get("task_prompt", ""))
-            )
+        self.store_agents([agent_data])
 
-            self.agents_collection.add(
-                ids=[elementId],
-                documents=[description_text],
-                metadatas=[metadata]
-            )
+    # Store several agents with a single collection.upsert call (idempotent, so indexing can be retried).
+    # Precomputed embeddings (e.g. from an export) are stored as given instead of being recomputed.
+    def store_agents(self, agents, embeddings=None):
+        if not agents:
+            return
+        try:
+            ids, documents, metadatas = zip(*(self.build_record(agent) for agent in agents))
+            if embeddings is not None:
+                embeddings = [list(map(float, vector)) for vector in embeddings]
+            elif INDEX_PROBLEM_EMBEDDING:
+                # Reuses the embedding computed (and cached) when the statement was looked up.
+                embeddings = self.embed(agent.get("problem_statement") or document
+                                        for agent, document in zip(agents, documents))
+            else:
+                embeddings = self.embed(documents)
+            with STAGE_LATENCY.time(stage="chroma_add"):
+                self.agents_collection.upsert(
+                    ids=list(ids),
+                    embeddings=embeddings,
+                    documents=list(documents) if CHROMA_RECORD_MODE != "compact" else None,
+                    metadatas=list(metadatas)
+                )
+            self._mirror_add(ids, embeddings, metadatas)
 
-            logging.debug("Stored Agent in ChromaDB with elementId: %s", elementId)
+            logging.debug("Stored %d Agent(s) in ChromaDB: %s", len(ids), list(ids))
+            self.cache_agents(agents)
         except Exception as e:
             logging.error("Error Storing Agent in ChromaDB: %s", str(e), exc_info=True)
             raise
 
-    def retrieve_agent_by_problem(self, problem_statement):
+    def cache_agents(self, agents):
+        # Write-through: new agents answer their own statements, and any cached
+        # "no match" may now be stale.
+        self.lookup_cache.invalidate_negatives()
+        for agent in agents:
+            if agent.get("problem_statement"):
+                self.lookup_cache.put(cache_key(agent["problem_statement"], _partition(agent)), {
+                    "elementId": agent["elementId"],
+                    "role": agent.get("role"),
+                    "role_description": agent.get("role_description"),
+                    "task_prompt": agent.get("task_prompt")
+                })
+
+    def refresh_agents(self, agents):
+        # Agents indexed by another worker: add them to the mirror (with their stored
+        # vectors) and to the lookup cache.
+        if (self.vector_index is not None or self.partition_indexes) and agents:
+            vectors = self.get_embeddings([agent["elementId"] for agent in agents])
+            stored = [agent for agent in agents if agent["elementId"] in vectors]
+            if stored:
+                self._mirror_add(
+                    [agent["elementId"] for agent in stored],
+                    [vectors[agent["elementId"]] for agent in stored],
+                    [self.build_record(agent)[2] for agent in stored]
+                )
+        self.cache_agents(agents)
+
+    def compact_collection(self, batch_size=1000):
+        """
+        Rewrites the agents collection with compact records: everything is copied into a
+        temporary collection, which then takes the original's name. Run with writers
+        stopped. Returns the number of records copied.
+        """
+        name = self.agents_collection.name
+        temporary, previous = f"{name}_compacting", f"{name}_previous"
+        existing = {collection.name for collection in self.chroma_client.list_collections()}
+        for stale in (temporary, previous):
+            if stale in existing:
+                self.chroma_client.delete_collection(stale)
+
+        target = self.chroma_client.create_collection(temporary, metadata=self.agents_collection.metadata)
+        copied = 0
+        while True:
+            page = self.agents_collection.get(include=["embeddings", "metadatas"], limit=batch_size, offset=copied)
+            if not page["ids"]:
+                break
+            target.add(
+                ids=page["ids"],
+                embeddings=page["embeddings"],
+                metadatas=[compact_metadata(metadata or {}) or {"role": "Undefined Role"}
+                           for metadata in page["metadatas"]]
+            )
+            copied += len(page["ids"])
+
+        # Swap names, then drop the original.
+        self.agents_collection.modify(name=previous)
+        target.modify(name=name)
+        self.chroma_client.delete_collection(previous)
+        self.agents_collection = target
+        self.reload_vector_index()
+        logging.info("Compacted %d ChromaDB records", copied)
+        return copied
+
+    def get_embeddings(self, ids):
+        # {id: embedding} for the stored ids among `ids`.
+        if not ids:
+            return {}
+        page = self.agents_collection.get(ids=list(ids), include=["embeddings"])
+        return {element_id: [float(x) for x in vector] for element_id, vector in zip(page["ids"], page["embeddings"])}
+
+    def existing_ids(self, ids):
+        # Subset of `ids` stored in the collection.
+        return set(self.agents_collection.get(ids=list(ids), include=[])["ids"]) if ids else set()
+
+    def ids_page(self, offset, limit=5000):
+        # One page of stored ids, in storage order.
+        return self.agents_collection.get(include=[], limit=limit, offset=offset)["ids"]
+
+    def iter_embeddings(self, batch_size=5000):
+        # Every stored (ids, embeddings, metadatas), one page at a time.
+        offset = 0
+        while True:
+            page = self.agents_collection.get(include=["embeddings", "metadatas"], limit=batch_size, offset=offset)
+            if not page["ids"]:
+                return
+            yield page["ids"], page["embeddings"], page["metadatas"]
+            offset += len(page["ids"])
+
+    def delete_agents(self, ids):
+        ids = list(ids)
+        if not ids:
+            return
+        self.agents_collection.delete(ids=ids)
+        if self.vector_index is not None:
+            self.vector_index.remove(ids)
+        with self._partition_lock:
+            for index in self.partition_indexes.values():
+                index.remove(ids)
+        # Cached matches may point at the deleted agents.
+        self.lookup_cache.clear()
+
+    def retrieve_agent_by_problem(self, problem_statement, use_cache=True, partition=None):
         # Retrieve agent from ChromaDB by problem statement.
         try:
-            results = self.agents_collection.query(query_texts=[problem_statement], n_results=1)
-            logging.debug("ChromaDB Query Results: %s", results)
-
-            if results and "documents" in results and results["documents"]:
-                similarity_scores = results.get("distances", [[1]])[0]
-                best_score = similarity_scores[0] if similarity_scores else 1
-                logging.debug("Similarity score for query '%s': %s", problem_statement, best_score)
-
-                # Changed threshold to be less strict (from 0.7 to 0.85)
-                SIMILARITY_THRESHOLD = 0.85
-                if best_score > SIMILARITY_THRESHOLD:
-                    logging.info(
-                        "No sufficiently similar agent found (score %s > threshold %s).",
-                        best_score, SIMILARITY_THRESHOLD
+            return self.retrieve_agents_by_problems([problem_statement], use_cache, [partition])[0]
+        except Exception as e:
+            logging.error("Error retrieving agent by problem: %s", str(e), exc_info=True)
+            return None
+
+    def retrieve_agents_by_problems(self, problem_statements, use_cache=True, partitions=None):
+        # Match several problem statements with one multi-text query; returns one entry (or None) per statement.
+        # Statements answered by the lookup cache are left out of the query; results are cached either way.
+        # With `partitions` (one root per statement, see VECTOR_PARTITIONING), each statement is
+        # only matched within its partition: one query per distinct partition.
+        partitions = partitions or [None] * len(problem_statements)
+        keys = [cache_key(statement, partition) for statement, partition in zip(problem_statements, partitions)]
+        matches = [self.lookup_cache.get(key) if use_cache else MISS for key in keys]
+        uncached = [index for index, match in enumerate(matches) if match is MISS]
+        if not uncached:
+            return matches
+
+        query_embeddings = dict(zip(uncached, self.embed(problem_statements[index] for index in uncached)))
+        groups = {}
+        for index in uncached:
+            groups.setdefault(partitions[index], []).append(index)
+        fallback = []
+        for partition, indexes in groups.items():
+            results = self._query([query_embeddings[index] for index in indexes], partition)
+            for position, index in enumerate(indexes):
+                matches[index] = self._best_match(results, position, problem_statements[index])
+                if matches[index] is None and partition is not None and PARTITION_FALLBACK_GLOBAL:
+                    fallback.append(index)
+        if fallback:
+            results = self._query([query_embeddings[index] for index in fallback], None)
+            for position, index in enumerate(fallback):
+                matches[index] = self._best_match(results, position, problem_statements[index])
+
+        for index in uncached:
+            self.lookup_cache.put(keys[index], matches[index])
+        return matches
+
+    def _query(self, query_embeddings, partition=None):
+        # Nearest stored agent per embedding, from the in-memory mirror when there is one.
+        with STAGE_LATENCY.time(stage="vector_query"):
+            if partition is None:
+                if self.vector_index is not None:
+                    results = self._query_vector_index(self.vector_index, query_embeddings)
+                else:
+                    results = self.agents_collection.query(query_embeddings=query_embeddings, n_results=1)
+            else:
+                index = self._partition_index(partition)
+                if index is not None:
+                    results = self._query_vector_index(index, query_embeddings)
+                else:
+                    results = self.agents_collection.query(
+                        query_embeddings=query_embeddings, n_results=1, where={"partition": partition}
                     )
-                    return None
+        log_sampled("ChromaDB Query Results: %s", results)
+        return results
 
-                # Return more metadata about the found agent
-                metadata = results.get("metadatas", [[]])[0][0]
-                return {
-                    "elementId": results.get("ids", [[]])[0][0],
-                    "role": metadata.get("role"),
-                    "role_description": metadata.get("role_description"),
-                    "task_prompt": metadata.get("task_prompt")
-                }
+    def _query_vector_index(self, index, query_embeddings, n_results=1):
+        # Same result shape as collection.query, so matching logic is shared.
+        hits = index.search(query_embeddings, k=n_results)
+        return {
+            "ids": [[element_id for element_id, _ in row] for row in hits],
+            "distances": [[distance for _, distance in row] for row in hits],
+            "metadatas": [[index.metadata.get(element_id, {}) for element_id, _ in row] for row in hits]
+        }
 
-        except Exception as e:
-            logging.error("Error retrieving agent by problem: %s", str(e), exc_info=True)
+    def lookup_cached(self, problem_statement, partition=None):
+        # Cache-only lookup; returns MISS when the statement has to go to Chroma.
+        return self.lookup_cache.get(cache_key(problem_statement, partition))
+
+    def _best_match(self, results, index, problem_statement):
+        ids = (results.get("ids") or [])
+        if index >= len(ids) or not ids[index]:
             return None
 
-        return None
+        similarity_scores = (results.get("distances") or [])[index] or [1]
+        best_score = similarity_scores[0]
+        MATCH_DISTANCE.observe(best_score)
+        logging.debug("Similarity score for query '%s': %s", problem_statement, best_score)
+
+        if best_score > SIMILARITY_THRESHOLD:
+            logging.info(
+                "No sufficiently similar agent found (score %s > threshold %s).",
+                best_score, SIMILARITY_THRESHOLD
+            )
+            return None
+
+        # Return more metadata about the found agent
+        metadata = results["metadatas"][index][0]
+        return {
+            "elementId": ids[index][0],
+            "role": metadata.get("role"),
+            "role_description": metadata.get("role_description"),
+            "task_prompt": metadata.get("task_prompt")
+        }
+
+
+def _partition(agent):
+    # The partition an agent's lookup cache entries belong to (None unless partitioning).
+    return agent.get("partition") if VECTOR_PARTITIONING == "tree" else None
+
+
+if __name__ == "__main__":
+    # Run from the agents_backend directory, with the server stopped:
+    #     python -m db.chroma_db compact
+    parser = argparse.ArgumentParser(description="ChromaDB maintenance")
+    parser.add_argument("command", choices=("compact",))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if CHROMA_RECORD_MODE != "compact":
+        logging.warning("CHROMA_RECORD_MODE is not 'compact': new agents will be stored as full records again")
+    manager = ChromaDBManager()
+    try:
+        print(f"Compacted {manager.compact_collection(args.batch_size)} records")
+    finally:
+        manager.close()
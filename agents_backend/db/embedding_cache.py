@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+
+# SQLite limits the number of bound parameters per statement.
+_SELECT_CHUNK = 500
+
+def embedding_namespace(embedding_function):
+    """
+    Identifies the model behind an embedding function: its name() plus its model
+    config, so switching models behind the same class doesn't replay stale vectors.
+    """
+    try:
+        name = embedding_function.name()
+    except (AttributeError, NotImplementedError):
+        name = type(embedding_function).__name__
+    try:
+        config = embedding_function.get_config()
+    except (AttributeError, NotImplementedError):
+        config = {}
+    model_name = getattr(embedding_function, "model_name", None)
+    if model_name is not None and "model_name" not in config:
+        config = dict(config, model_name=model_name)
+    return f"{name}:{json.dumps(config, sort_keys=True, default=str)}"
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """
+    Wraps an embedding function with an on-disk cache keyed by a hash of the
+    namespace (model) and text. Cache misses in a call are embedded together in
+    one batched call to the wrapped function; vectors are stored as float32 blobs.
+    """
+    def __init__(self, embedding_function, path, namespace=None):
+        self.embedding_function = embedding_function
+        self.namespace = namespace or embedding_namespace(embedding_function)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+        logging.info(f"Embedding cache at {path} (namespace {self.namespace})")
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    def __call__(self, input):
+        texts = list(input)
+        keys = [self._key(text) for text in texts]
+        cached = self._load(set(keys))
+
+        # Embed every distinct uncached text in one call.
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embedding_function(list(missing.values()))
+            fresh = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, vectors)}
+            self._save(fresh)
+            cached.update(fresh)
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return [cached[key] for key in keys]
+
+    def _load(self, keys):
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            for start in range(0, len(keys), _SELECT_CHUNK):
+                chunk = keys[start:start + _SELECT_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def _save(self, vectors):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.tobytes()) for key, vector in vectors.items()]
+            )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+            return {"size": size, "hits": self.hits, "misses": self.misses, "namespace": self.namespace}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
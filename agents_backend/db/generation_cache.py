@@ -0,0 +1,138 @@
+"""
+On-disk cache of completed LLM generations (GENERATION_CACHE_ENABLED).
+
+Entries are keyed by a hash of the model, the rendered messages and the generation
+options, so any prompt or schema change misses. Inspect or invalidate it (from the
+agents_backend directory) with:
+
+    python -m db.generation_cache stats
+    python -m db.generation_cache invalidate --model llama3.2
+"""
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_GENERATION_CACHE_PATH = os.path.join(os.path.dirname(__file__), "generation_cache.sqlite3")
+
+class GenerationCache:
+    """
+    Parsed, validated generation results in SQLite, bounded to `max_entries` with
+    least-recently-used eviction. Eviction runs once the table has grown past
+    `max_entries` by a tenth, so most inserts don't pay for it. A read-only cache
+    serves hits but never writes, not even recency updates, so benchmark runs leave
+    it unchanged. Async callers go through run_in_executor.
+    """
+    def __init__(self, path, max_entries=100000, read_only=False):
+        self.max_entries = max_entries
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, value TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS generations_model ON generations (model)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT count(*) FROM generations").fetchone()[0]
+        self._evict_margin = max(1, max_entries // 10)
+        # One thread: SQLite calls are serialized by the lock anyway.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generation-cache")
+        logging.info(f"Generation cache at {path}{' (read-only)' if read_only else ''}")
+
+    async def run_in_executor(self, func, *args, **kwargs):
+        # Run a cache call without stalling the event loop.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    @staticmethod
+    def key(model, messages, options):
+        payload = json.dumps({"model": model, "messages": messages, "options": options}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        # Returns the cached value, or None.
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.read_only:
+                self._conn.execute("UPDATE generations SET last_used = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, model, value):
+        if self.read_only:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generations (key, model, value, last_used) VALUES (?, ?, ?, ?)",
+                (key, model, json.dumps(value), time.time())
+            )
+            # Counts replacements too, so it only overestimates the size.
+            self._size += 1
+            if self._size > self.max_entries + self._evict_margin:
+                # Evict everything past the newest max_entries.
+                self._conn.execute(
+                    "DELETE FROM generations WHERE key IN "
+                    "(SELECT key FROM generations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+                self._size = self._conn.execute("SELECT count(*) FROM generations").fetchone()[0]
+            self._conn.commit()
+
+    def invalidate(self, model=None):
+        # Drops the entries generated by `model` (every entry when None); returns how many.
+        with self._lock:
+            if model is None:
+                deleted = self._conn.execute("DELETE FROM generations").rowcount
+            else:
+                deleted = self._conn.execute("DELETE FROM generations WHERE model = ?", (model,)).rowcount
+            self._conn.commit()
+            self._size = max(0, self._size - deleted)
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT count(*) FROM generations").fetchone()[0]
+            return {"size": size, "hits": self.hits, "misses": self.misses, "read_only": self.read_only}
+
+    def models(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT model, count(*) FROM generations GROUP BY model").fetchall())
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    from config import GENERATION_CACHE_PATH
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("stats", "invalidate"))
+    parser.add_argument("--model", help="only invalidate this model's entries (default: all)")
+    args = parser.parse_args()
+    cache = GenerationCache(GENERATION_CACHE_PATH or DEFAULT_GENERATION_CACHE_PATH)
+    try:
+        if args.command == "stats":
+            print(json.dumps(dict(cache.stats(), models=cache.models()), indent=2))
+        else:
+            print(f"Invalidated {cache.invalidate(args.model)} generations")
+    finally:
+        cache.close()
@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by LookupCache.get when the statement is not cached (None is a cached "no match").
+MISS = object()
+
+class LookupCache:
+    """
+    Bounded LRU cache of normalized problem statement -> matched agent.
+    A None value records "no match" and expires after the shorter negative TTL.
+    Thread-safe, since Chroma lookups run on the executor pool.
+    """
+    def __init__(self, max_size, ttl, negative_ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()    # key -> (expires_at, agent)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return MISS
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISS
+            self._entries.move_to_end(key)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[1]
+
+    def put(self, key, agent):
+        if not self.enabled:
+            return
+        ttl = self.ttl if agent is not None else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, agent)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_negatives(self):
+        # A newly stored agent may now match statements cached as "no match".
+        with self._lock:
+            for key in [key for key, (_, agent) in self._entries.items() if agent is None]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0
+            }
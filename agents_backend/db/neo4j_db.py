@@ -1,147 +1,658 @@
-from neo4j import GraphDatabase
+from neo4j import AsyncGraphDatabase
 import json
 import logging
-from config import NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD
+from config import (
+    NEO4J_URI,
+    NEO4J_USER,
+    NEO4J_PASSWORD,
+    NEO4J_MAX_CONNECTION_POOL_SIZE,
+    NEO4J_CONNECTION_ACQUISITION_TIMEOUT,
+    NEO4J_MAX_CONNECTION_LIFETIME
+)
 
-# Initialize the Neo4j driver
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+# The async Neo4j driver (graph calls never block the event loop), created on first use
+# so importing this module does not open a connection pool.
+_driver = None
 
-#It creates or updates a parent agent node in Neo4j using the external parent ID, and any new node is labeled "DummyAgent."
-def create_parent_agent_node(agent_data):
-    with driver.session() as session:
-        session.execute_write(
-            lambda tx: tx.run(
-                """
-                MERGE (d:DummyAgent {agent_id: $agent_id})
-                SET d.problem_statement = $problem_statement
-                """,
-                agent_id=agent_data["agent_id"],
-                problem_statement=agent_data["problem_statement"]
-            )
+def get_driver():
+    global _driver
+    if _driver is None:
+        _driver = AsyncGraphDatabase.driver(
+            NEO4J_URI,
+            auth=(NEO4J_USER, NEO4J_PASSWORD),
+            max_connection_pool_size=NEO4J_MAX_CONNECTION_POOL_SIZE,
+            connection_acquisition_timeout=NEO4J_CONNECTION_ACQUISITION_TIMEOUT,
+            max_connection_lifetime=NEO4J_MAX_CONNECTION_LIFETIME
         )
+    return _driver
 
-#  MERGE the agent node in Neo4j (for similar agents) using the composite identifier (elementId)
-def ensure_agent_node_exists(agent_data):
-    with driver.session() as session:
-        session.execute_write(
-            lambda tx: tx.run(
-                """
-                MERGE (a:Agent {elementId: $elementId})
-                SET a.problem_statement = $problem_statement,
-                    a.role = $role,
-                    a.role_description = $role_description,
-                    a.task_prompt = $task_prompt,
-                    a.creation_timestamp = $creation_timestamp,
-                    a.llm_used = $llm_used
-                """,
-                elementId=agent_data["elementId"],
-                problem_statement=agent_data.get("problem_statement", ""),
-                role=agent_data.get("role", "Undefined Role"),
-                role_description=agent_data.get("role_description", ""),
-                task_prompt=agent_data.get("task_prompt", ""),
-                creation_timestamp=agent_data.get("creation_timestamp", 0),
-                llm_used=agent_data.get("llm_used", "Unknown")
-            )
+async def verify_connectivity():
+    """
+    Raises if the Neo4j server cannot be reached with the configured credentials.
+    """
+    await get_driver().verify_connectivity()
+
+# Constraints backing every MERGE/MATCH key used by the registry; each also creates a range index.
+SCHEMA_STATEMENTS = [
+    "CREATE CONSTRAINT agent_element_id IF NOT EXISTS FOR (a:Agent) REQUIRE a.elementId IS UNIQUE",
+    "CREATE CONSTRAINT dummy_agent_id IF NOT EXISTS FOR (d:DummyAgent) REQUIRE d.agent_id IS UNIQUE",
+    "CREATE CONSTRAINT super_parent_id IF NOT EXISTS FOR (s:SuperParent) REQUIRE s.id IS UNIQUE",
+    "CREATE CONSTRAINT registry_version_id IF NOT EXISTS FOR (v:RegistryVersion) REQUIRE v.id IS UNIQUE",
+    "CREATE INDEX agent_indexed_version IF NOT EXISTS FOR (a:Agent) ON (a.indexed_version)",
+]
+
+async def ensure_schema():
+    """
+    Creates the registry's constraints and indexes if they are missing.
+    Safe to run on every startup; schema commands run in their own auto-commit transactions.
+    """
+    async with get_driver().session() as session:
+        for statement in SCHEMA_STATEMENTS:
+            result = await session.run(statement)
+            await result.consume()
+    logging.info("Neo4j schema bootstrap complete (%d statements)", len(SCHEMA_STATEMENTS))
+
+async def check_agents_exist():
+    """
+    Check if any Agent nodes exist in Neo4j.
+    Returns True if agents exist, False otherwise.
+    Stops at the first Agent found instead of counting them all.
+    """
+    async def _any_agent(tx):
+        result = await tx.run(
+            """
+            MATCH (a:Agent)
+            RETURN a.elementId AS elementId
+            LIMIT 1
+            """
         )
+        return await result.single()
 
-# Creates a new Agent node in Neo4j with the provided properties and returns its unique elementId.
-def create_agent_node(agent_data):
-    def _create_agent_node(tx, agent_data):
-        query = """
-            CREATE (a:Agent {
-                elementId: randomUUID(),  // Add explicit elementId
-                problem_statement: $problem_statement,
-                role: $role,
-                role_description: $role_description,
-                task_prompt: $task_prompt,
-                creation_timestamp: $creation_timestamp,
-                llm_used: $llm_used
+    async with get_driver().session() as session:
+        record = await session.execute_read(_any_agent)
+        return record is not None
+
+async def create_super_parent_node():
+    """
+    Creates a super parent node in Neo4j.
+    Returns the ID of the created node.
+    """
+    async def _create_super_parent(tx):
+        result = await tx.run(
+            """
+            CREATE (s:SuperParent {
+                id: 'super_parent_' + randomUUID(),
+                created_at: datetime()
             })
+            RETURN s.id as id
+            """
+        )
+        return await result.single()
+
+    async with get_driver().session() as session:
+        result = await session.execute_write(_create_super_parent)
+        return result["id"]
+
+# Resolves each row's parent, upserts the agent and merges the DEPENDS_ON edge in one statement.
+# The parent is an Agent (by elementId) or SuperParent (by id); unknown ids become a DummyAgent,
+# and a null parent_id creates a new SuperParent for the registry's first agent.
+REGISTER_AGENTS_QUERY = """
+UNWIND $rows AS row
+OPTIONAL MATCH (ap:Agent {elementId: row.parent_id})
+OPTIONAL MATCH (sp:SuperParent {id: row.parent_id})
+CALL {
+    WITH row, ap, sp
+    WITH row WHERE row.parent_id IS NULL
+    CREATE (s:SuperParent {
+        id: 'super_parent_' + randomUUID(),
+        created_at: datetime()
+    })
+    RETURN s AS p, true AS parent_created
+  UNION
+    WITH row, ap, sp
+    WITH ap, sp WHERE ap IS NOT NULL OR sp IS NOT NULL
+    RETURN coalesce(ap, sp) AS p, false AS parent_created
+  UNION
+    WITH row, ap, sp
+    WITH row WHERE row.parent_id IS NOT NULL AND ap IS NULL AND sp IS NULL
+    MERGE (d:DummyAgent {agent_id: row.parent_id})
+    SET d.problem_statement = row.problem_statement
+    RETURN d AS p, false AS parent_created
+}
+MERGE (c:Agent {elementId: row.agent.elementId})
+ON CREATE SET c += row.agent
+MERGE (p)-[:DEPENDS_ON]->(c)
+RETURN coalesce(p.elementId, p.id, p.agent_id) AS parent_id,
+       parent_created,
+       c.elementId AS elementId
+"""
+
+async def _register_agents(tx, rows):
+    result = await tx.run(REGISTER_AGENTS_QUERY, rows=rows)
+    return [record.data() async for record in result]
+
+async def register_agent(parent_id, problem_statement, agent_data):
+    """
+    Registers one parent -> agent mapping in a single managed write transaction.
+    Returns {"parent_id", "parent_created", "elementId"} so the caller needs no
+    further round trips; nothing is written if any part fails.
+    """
+    row = {
+        "parent_id": parent_id,
+        "problem_statement": problem_statement,
+        "agent": agent_data
+    }
+    async with get_driver().session() as session:
+        records = await session.execute_write(_register_agents, [row])
+        return records[0]
+
+async def register_agents_batch(rows):
+    """
+    Registers a batch of parent -> agent mappings in a single write transaction.
+    Each row is {"parent_id", "problem_statement", "agent": {elementId, role, ...}}
+    and is resolved exactly like register_agent.
+    """
+    if not rows:
+        return []
+
+    async with get_driver().session() as session:
+        return await session.execute_write(_register_agents, rows)
+
+async def register_decomposition(rows, dependencies):
+    """
+    Registers the subagents of one decomposition in a single write transaction:
+    `rows` map the parent to each subagent (as in register_agents_batch) and
+    `dependencies` are {"from", "to"} elementId pairs between subagents.
+    """
+    async def _register_decomposition(tx, rows, dependencies):
+        records = await _register_agents(tx, rows)
+        result = await tx.run(
+            """
+            UNWIND $dependencies AS dependency
+            MATCH (a:Agent {elementId: dependency.from})
+            MATCH (b:Agent {elementId: dependency.to})
+            MERGE (a)-[:DEPENDS_ON]->(b)
+            """,
+            dependencies=dependencies
+        )
+        await result.consume()
+        return records
+
+    async with get_driver().session() as session:
+        return await session.execute_write(_register_decomposition, rows, dependencies)
+
+async def get_existing_agent_ids(element_ids):
+    """
+    Returns the subset of `element_ids` that exist as Agent nodes.
+    """
+    async def _existing(tx):
+        result = await tx.run(
+            """
+            UNWIND $ids AS id
+            MATCH (a:Agent {elementId: id})
             RETURN a.elementId AS elementId
-        """
-        result = tx.run(
-            query,
-            problem_statement=agent_data.get("problem_statement", ""),
-            role=agent_data.get("role", "Undefined Role"),
-            role_description=agent_data.get("role_description", ""),
-            task_prompt=agent_data.get("task_prompt", ""),
-            creation_timestamp=agent_data.get("creation_timestamp", 0),
-            llm_used=agent_data.get("llm_used", "Unknown")
+            """,
+            ids=list(element_ids)
+        )
+        return {record["elementId"] async for record in result}
+
+    async with get_driver().session() as session:
+        return await session.execute_read(_existing)
+
+async def get_agents_page(after=None, limit=1000):
+    """
+    Returns up to `limit` Agent property maps ordered by elementId, starting after
+    `after` (keyset pagination over the elementId constraint's index).
+    """
+    async def _page(tx):
+        result = await tx.run(
+            """
+            MATCH (a:Agent)
+            WHERE a.elementId > $after
+            RETURN properties(a) AS agent
+            ORDER BY a.elementId
+            LIMIT $limit
+            """,
+            after=after or "",
+            limit=limit
         )
-        record = result.single()
-        return record["elementId"]
+        return [_plain(record["agent"]) async for record in result]
 
-    with driver.session() as session:
-        element_id = session.execute_write(_create_agent_node, agent_data)
-        return element_id
+    async with get_driver().session() as session:
+        return await session.execute_read(_page)
 
+# Resolves $id to the node it names: an Agent (elementId), SuperParent (id) or DummyAgent (agent_id).
+RESOLVE_NODE = """
+CALL {
+    MATCH (n:Agent {elementId: $id}) RETURN n
+  UNION
+    MATCH (n:SuperParent {id: $id}) RETURN n
+  UNION
+    MATCH (n:DummyAgent {agent_id: $id}) RETURN n
+}
+"""
+
+# Agent fields returned by the read APIs, projected in the query so nodes are hydrated in bulk.
+AGENT_PROJECTION = (
+    "{.elementId, .role, .role_description, .task_prompt, .problem_statement, .creation_timestamp, .llm_used,"
+    " .partition}"
+)
+
+def _plain(properties):
+    # Neo4j temporal values -> ISO strings so results can be returned as JSON.
+    return {
+        key: value.iso_format() if hasattr(value, "iso_format") else value
+        for key, value in properties.items()
+    }
+
+async def _agents_by_ids(tx, element_ids):
+    # Projected agents for the given ids, as {elementId: agent}.
+    if not element_ids:
+        return {}
+    result = await tx.run(
+        f"""
+        UNWIND $ids AS id
+        MATCH (a:Agent {{elementId: id}})
+        RETURN a {AGENT_PROJECTION} AS agent
+        """,
+        ids=element_ids
+    )
+    return {record["agent"]["elementId"]: _plain(record["agent"]) async for record in result}
+
+async def get_agents_by_ids(element_ids):
+    """
+    Returns {elementId: agent fields} for the ids among `element_ids` that exist as Agent nodes.
+    """
+    async with get_driver().session() as session:
+        return await session.execute_read(_agents_by_ids, list(element_ids))
+
+async def get_registry_node(node_id):
+    """
+    Returns {"kind", "properties", "child_count"} for the Agent, SuperParent or
+    DummyAgent named by `node_id`, or None if there is none.
+    """
+    async def _get_node(tx):
+        result = await tx.run(
+            RESOLVE_NODE + """
+            RETURN labels(n)[0] AS kind,
+                   properties(n) AS properties,
+                   size([(n)-[:DEPENDS_ON]->(c:Agent) | c]) AS child_count
+            LIMIT 1
+            """,
+            id=node_id
+        )
+        return await result.single()
+
+    async with get_driver().session() as session:
+        record = await session.execute_read(_get_node)
+        if record is None:
+            return None
+        return {"kind": record["kind"], "properties": _plain(record["properties"]), "child_count": record["child_count"]}
+
+async def get_children_page(node_id, after=None, limit=100):
+    """
+    Returns up to `limit` direct DEPENDS_ON children of `node_id`, ordered by
+    elementId and starting after `after` (keyset pagination).
+    """
+    async def _children(tx):
+        result = await tx.run(
+            RESOLVE_NODE + f"""
+            MATCH (n)-[:DEPENDS_ON]->(c:Agent)
+            WHERE c.elementId > $after
+            RETURN c {AGENT_PROJECTION} AS agent
+            ORDER BY c.elementId
+            LIMIT $limit
+            """,
+            id=node_id, after=after or "", limit=limit
+        )
+        return [_plain(record["agent"]) async for record in result]
 
+    async with get_driver().session() as session:
+        return await session.execute_read(_children)
 
-def create_relationship(parent_agent_id, child_agent_id):
-    with driver.session() as session:
-        session.execute_write(
-            lambda tx: tx.run(
+async def get_subtree_page(node_id, depth, after=None, limit=100):
+    """
+    Returns up to `limit` agents reachable from `node_id` within `depth` DEPENDS_ON
+    hops, as {"agent", "depth", "parent_ids"} ordered by (depth, elementId).
+    `after` is the (depth, elementId) of the previous page's last row. The subtree
+    is expanded one level at a time (distinct nodes, not paths) and only as deep
+    as the page needs; an agent reachable over several paths appears once, at its
+    shortest depth, with its parents on the level above.
+    """
+    after_depth, after_id = after or (0, "")
+
+    async def _subtree(tx):
+        result = await tx.run(
+            RESOLVE_NODE + """
+            MATCH (n)-[:DEPENDS_ON]->(c:Agent)
+            RETURN c.elementId AS id, collect(DISTINCT coalesce(n.elementId, n.id, n.agent_id)) AS parents
+            """,
+            id=node_id
+        )
+        level = {record["id"]: record["parents"] async for record in result}
+        seen = set(level)
+        rows = []
+        current = 1
+        while level:
+            if current >= after_depth:
+                ids = sorted(
+                    element_id for element_id in level if current > after_depth or element_id > after_id
+                )[:limit - len(rows)]
+                agents = await _agents_by_ids(tx, ids)
+                rows.extend(
+                    {"agent": agents[element_id], "depth": current, "parent_ids": level[element_id]}
+                    for element_id in ids if element_id in agents
+                )
+            if current >= depth or len(rows) >= limit:
+                break
+            # Next level: children of this level not already seen at a shallower depth.
+            result = await tx.run(
                 """
-                MATCH (p), (c:Agent {elementId: $child})
-                WHERE (p:DummyAgent AND p.agent_id = $parent) 
-                   OR (p:SuperParent AND p.id = $parent)
-                MERGE (p)-[:DEPENDS_ON]->(c)
+                UNWIND $ids AS id
+                MATCH (:Agent {elementId: id})-[:DEPENDS_ON]->(c:Agent)
+                RETURN c.elementId AS id, collect(DISTINCT id) AS parents
                 """,
-                parent=parent_agent_id,
-                child=child_agent_id
+                ids=list(level)
             )
+            level = {record["id"]: record["parents"] async for record in result if record["id"] not in seen}
+            seen.update(level)
+            current += 1
+        return rows
+
+    async with get_driver().session() as session:
+        return await session.execute_read(_subtree)
+
+# Parent node labels other than Agent, with their key property.
+PARENT_KEYS = {"SuperParent": "id", "DummyAgent": "agent_id"}
+
+async def get_parent_nodes_page(label, after=None, limit=1000):
+    """
+    Returns up to `limit` SuperParent or DummyAgent property maps ordered by their
+    key, starting after `after` (keyset pagination).
+    """
+    key = PARENT_KEYS[label]
+
+    async def _page(tx):
+        result = await tx.run(
+            f"""
+            MATCH (n:{label})
+            WHERE n.{key} > $after
+            RETURN properties(n) AS node
+            ORDER BY n.{key}
+            LIMIT $limit
+            """,
+            after=after or "",
+            limit=limit
         )
+        return [_plain(record["node"]) async for record in result]
 
+    async with get_driver().session() as session:
+        return await session.execute_read(_page)
 
-# Retrieves an Agent node from Neo4j by its elementId.
-def get_agent_node_by_elementId(element_id):
-    def _get_agent_node(tx, element_id):
-        query = """
-            MATCH (a:Agent)
-            WHERE elementId(a) = $id
-            RETURN a
-            LIMIT 1
-        """
-        result = tx.run(query, id=element_id)
-        return result.single()
-    
-    with driver.session() as session:
-        record = session.execute_read(_get_agent_node, element_id)
-        if record:
-            return record["a"]
-        return None     #Returns the node record if found, or None otherwise.
-
-def check_agents_exist():
+async def get_incoming_edges(element_ids):
     """
-    Check if any Agent nodes exist in Neo4j.
-    Returns True if agents exist, False otherwise.
+    Returns the DEPENDS_ON edges into the given agents as {"from", "from_kind", "to"}.
     """
-    with driver.session() as session:
-        result = session.execute_read(
-            lambda tx: tx.run(
-                """
-                MATCH (a:Agent)
-                RETURN count(a) as count
-                """
-            ).single()
+    async def _edges(tx):
+        result = await tx.run(
+            """
+            UNWIND $ids AS id
+            MATCH (p)-[:DEPENDS_ON]->(c:Agent {elementId: id})
+            RETURN coalesce(p.elementId, p.id, p.agent_id) AS from, labels(p)[0] AS from_kind, id AS to
+            """,
+            ids=list(element_ids)
         )
-        return result["count"] > 0
+        return [record.data() async for record in result]
+
+    async with get_driver().session() as session:
+        return await session.execute_read(_edges)
 
-def create_super_parent_node():
+# Bulk-load statements, one UNWIND per record kind. Every statement MERGEs, so
+# records can arrive in any order (an edge may create its endpoints before their
+# own records fill them in) and an import can be re-run.
+IMPORT_QUERIES = {
+    "super_parent": """
+        UNWIND $rows AS row
+        MERGE (s:SuperParent {id: row.id})
+        SET s.created_at = coalesce(datetime(row.created_at), s.created_at, datetime())
+    """,
+    "dummy_agent": """
+        UNWIND $rows AS row
+        MERGE (d:DummyAgent {agent_id: row.agent_id})
+        SET d.problem_statement = row.problem_statement
+    """,
+    "agent": """
+        UNWIND $rows AS row
+        MERGE (a:Agent {elementId: row.elementId})
+        SET a += row
+    """,
+    "edge": """
+        UNWIND $rows AS row
+        CALL {
+            WITH row
+            WITH row WHERE row.from_kind = 'Agent'
+            MERGE (p:Agent {elementId: row.from})
+            RETURN p
+          UNION
+            WITH row
+            WITH row WHERE row.from_kind = 'SuperParent'
+            MERGE (p:SuperParent {id: row.from})
+            RETURN p
+          UNION
+            WITH row
+            WITH row WHERE row.from_kind = 'DummyAgent'
+            MERGE (p:DummyAgent {agent_id: row.from})
+            RETURN p
+        }
+        MERGE (c:Agent {elementId: row.to})
+        MERGE (p)-[:DEPENDS_ON]->(c)
     """
-    Creates a super parent node in Neo4j.
-    Returns the ID of the created node.
+}
+
+async def import_rows(kind, rows):
     """
-    with driver.session() as session:
-        result = session.execute_write(
-            lambda tx: tx.run(
-                """
-                CREATE (s:SuperParent {
-                    id: 'super_parent_' + randomUUID(),
-                    created_at: datetime()
-                })
-                RETURN s.id as id
-                """
-            ).single()
+    Writes one batch of exported records of `kind` (see IMPORT_QUERIES) in a single transaction.
+    """
+    if not rows:
+        return
+
+    async def _import(tx):
+        result = await tx.run(IMPORT_QUERIES[kind], rows=rows)
+        await result.consume()
+
+    async with get_driver().session() as session:
+        await session.execute_write(_import)
+
+async def get_partition_roots(node_ids):
+    """
+    Returns {node_id: root id} for the ids that exist: a SuperParent or DummyAgent is its
+    own root, and an Agent's root is its stored `partition` or, for agents registered
+    before partitioning, the nearest top-most ancestor (possibly itself).
+    """
+    async def _roots(tx):
+        result = await tx.run(
+            """
+            UNWIND $ids AS id
+            CALL {
+                WITH id
+                MATCH (s:SuperParent {id: id})
+                RETURN s.id AS root
+              UNION
+                WITH id
+                MATCH (d:DummyAgent {agent_id: id})
+                RETURN d.agent_id AS root
+              UNION
+                WITH id
+                MATCH (a:Agent {elementId: id}) WHERE a.partition IS NOT NULL
+                RETURN a.partition AS root
+              UNION
+                WITH id
+                MATCH (a:Agent {elementId: id}) WHERE a.partition IS NULL
+                MATCH path = (r)-[:DEPENDS_ON*0..]->(a)
+                WHERE NOT ()-[:DEPENDS_ON]->(r)
+                WITH r, length(path) AS hops
+                ORDER BY hops
+                LIMIT 1
+                RETURN coalesce(r.id, r.agent_id, r.elementId) AS root
+            }
+            RETURN id, root
+            """,
+            ids=list(node_ids)
         )
-        return result["id"]
+        return {record["id"]: record["root"] async for record in result}
+
+    async with get_driver().session() as session:
+        return await session.execute_read(_roots)
+
+async def set_agent_partitions(rows):
+    """
+    Stores the partition root on existing Agent nodes; `rows` are {"elementId", "partition"}.
+    """
+    async def _set(tx):
+        result = await tx.run(
+            """
+            UNWIND $rows AS row
+            MATCH (a:Agent {elementId: row.elementId})
+            SET a.partition = row.partition
+            """,
+            rows=rows
+        )
+        await result.consume()
+
+    async with get_driver().session() as session:
+        await session.execute_write(_set)
+
+async def merge_duplicate_agents(pairs):
+    """
+    Folds each duplicate agent into its canonical agent: DEPENDS_ON edges into and out of
+    the duplicate are re-created on the canonical (never as self-loops) and the duplicate
+    is deleted. `pairs` is a list of {"duplicate", "canonical"} elementIds, written in one
+    transaction. Returns {"merged", "rewired_edges"}.
+    """
+    async def _merge(tx):
+        result = await tx.run(
+            """
+            UNWIND $pairs AS pair
+            MATCH (d:Agent {elementId: pair.duplicate})
+            MATCH (c:Agent {elementId: pair.canonical})
+            OPTIONAL MATCH (p)-[:DEPENDS_ON]->(d) WHERE p <> c
+            WITH d, c, collect(DISTINCT p) AS parents
+            OPTIONAL MATCH (d)-[:DEPENDS_ON]->(x) WHERE x <> c
+            WITH d, c, parents, collect(DISTINCT x) AS children
+            FOREACH (p IN parents | MERGE (p)-[:DEPENDS_ON]->(c))
+            FOREACH (x IN children | MERGE (c)-[:DEPENDS_ON]->(x))
+            WITH d, size(parents) + size(children) AS rewired
+            DETACH DELETE d
+            RETURN count(*) AS merged, sum(rewired) AS rewired_edges
+            """,
+            pairs=pairs
+        )
+        record = await result.single()
+        return {"merged": record["merged"], "rewired_edges": record["rewired_edges"] or 0}
+
+    async with get_driver().session() as session:
+        return await session.execute_write(_merge)
+
+# Registry version stamp shared by all workers: `version` is bumped whenever agents are
+# indexed (each indexed agent records the version as `indexed_version`) or deleted
+# (`purged_version`), so workers can tell which of their cached state is stale. Bumps
+# lock the single RegistryVersion node, so versions become visible in commit order.
+REGISTRY_VERSION_KEY = "registry"
+
+async def stamp_indexed_agents(element_ids):
+    """
+    Bumps the registry version and stamps the given agents with it; returns the new version.
+    """
+    async def _stamp(tx):
+        result = await tx.run(
+            """
+            MERGE (v:RegistryVersion {id: $key})
+            ON CREATE SET v.version = 0, v.purged_version = 0
+            SET v.version = v.version + 1
+            WITH v
+            OPTIONAL MATCH (a:Agent) WHERE a.elementId IN $ids
+            SET a.indexed_version = v.version
+            RETURN DISTINCT v.version AS version
+            """,
+            key=REGISTRY_VERSION_KEY,
+            ids=list(element_ids)
+        )
+        record = await result.single()
+        return record["version"]
+
+    async with get_driver().session() as session:
+        return await session.execute_write(_stamp)
+
+async def bump_purged_version():
+    """
+    Records that agents were deleted (or the registry reset): workers drop their caches.
+    Returns the new version.
+    """
+    async def _bump(tx):
+        result = await tx.run(
+            """
+            MERGE (v:RegistryVersion {id: $key})
+            ON CREATE SET v.version = 0
+            SET v.version = v.version + 1
+            SET v.purged_version = v.version
+            RETURN v.version AS version
+            """,
+            key=REGISTRY_VERSION_KEY
+        )
+        record = await result.single()
+        return record["version"]
+
+    async with get_driver().session() as session:
+        return await session.execute_write(_bump)
+
+async def get_registry_version():
+    """
+    Returns (version, purged_version); (0, 0) before anything was stamped.
+    """
+    async def _get(tx):
+        result = await tx.run(
+            """
+            MATCH (v:RegistryVersion {id: $key})
+            RETURN v.version AS version, coalesce(v.purged_version, 0) AS purged_version
+            """,
+            key=REGISTRY_VERSION_KEY
+        )
+        record = await result.single()
+        return (record["version"], record["purged_version"]) if record else (0, 0)
+
+    async with get_driver().session() as session:
+        return await session.execute_read(_get)
+
+async def get_agents_indexed_between(since, until, after=None, limit=1000):
+    """
+    Returns up to `limit` agents stamped with an indexed_version in (since, until],
+    ordered by (indexed_version, elementId); `after` is the last row's pair.
+    """
+    after_version, after_id = after or (since, "")
+
+    async def _page(tx):
+        result = await tx.run(
+            f"""
+            MATCH (a:Agent)
+            WHERE a.indexed_version > $since AND a.indexed_version <= $until
+              AND (a.indexed_version > $after_version
+                   OR (a.indexed_version = $after_version AND a.elementId > $after_id))
+            RETURN a {AGENT_PROJECTION} AS agent, a.indexed_version AS indexed_version
+            ORDER BY a.indexed_version, a.elementId
+            LIMIT $limit
+            """,
+            since=since, until=until, after_version=after_version, after_id=after_id, limit=limit
+        )
+        return [(_plain(record["agent"]), record["indexed_version"]) async for record in result]
+
+    async with get_driver().session() as session:
+        return await session.execute_read(_page)
+
+async def close_driver():
+    """
+    Closes the Neo4j driver and its connection pool (if it was ever opened).
+    """
+    global _driver
+    if _driver is not None:
+        await _driver.close()
+        _driver = None
@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_OUTBOX_PATH = os.path.join(os.path.dirname(__file__), "index_outbox.sqlite3")
+
+# SQLite limits the number of bound parameters per statement.
+_CHUNK = 500
+
+class IndexOutbox:
+    """
+    Durable queue of agents waiting to be written to the vector store.
+    Entries are keyed by elementId (re-enqueueing replaces the entry). claim()
+    leases a batch in one atomic statement, so other indexers sharing the file (in
+    this process or another) skip it; complete() removes entries and fail()
+    schedules a retry with exponential backoff.
+    """
+    def __init__(self, path, lease_seconds=30.0, max_backoff=60.0):
+        self.lease_seconds = lease_seconds
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")     # An acknowledged enqueue must survive a crash.
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                element_id TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                last_error TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_available_at ON outbox (available_at)")
+        self._conn.commit()
+        logging.info(f"Index outbox at {path}")
+
+    def enqueue(self, agents):
+        now = time.time()
+        # REPLACE deletes the old row, so a re-enqueued agent gets a new id: an
+        # indexer still holding the old lease can't complete() the newer payload.
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO outbox (element_id, payload, created_at, available_at) VALUES (?, ?, ?, ?)",
+                [(agent["elementId"], json.dumps(agent), now, now) for agent in agents]
+            )
+            self._conn.commit()
+
+    def claim(self, limit):
+        # Returns up to `limit` due entries as (id, created_at, agent) and leases them.
+        now = time.time()
+        with self._lock:
+            # Select and lease in a single UPDATE: it holds SQLite's write lock throughout,
+            # so indexers in other processes can never lease the same entries.
+            rows = self._conn.execute(
+                """
+                UPDATE outbox SET available_at = ?
+                WHERE id IN (SELECT id FROM outbox WHERE available_at <= ? ORDER BY id LIMIT ?)
+                RETURNING id, created_at, payload
+                """,
+                (now + self.lease_seconds, now, limit)
+            ).fetchall()
+            self._conn.commit()
+        # RETURNING gives no order guarantee.
+        rows.sort()
+        return [(row_id, created_at, json.loads(payload)) for row_id, created_at, payload in rows]
+
+    def complete(self, ids):
+        ids = list(ids)
+        with self._lock:
+            for start in range(0, len(ids), _CHUNK):
+                chunk = ids[start:start + _CHUNK]
+                self._conn.execute(f"DELETE FROM outbox WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            self._conn.commit()
+
+    def fail(self, ids, error):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                """
+                UPDATE outbox SET attempts = attempts + 1, last_error = ?,
+                    available_at = ? + min(?, 0.5 * (1 << min(attempts, 16)))
+                WHERE id = ?
+                """,
+                [(str(error)[:500], now, self.max_backoff, row_id) for row_id in ids]
+            )
+            self._conn.commit()
+
+    def defer(self, ids, delay):
+        # Retry later without counting a failed attempt.
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET available_at = ? WHERE id = ?",
+                [(time.time() + delay, row_id) for row_id in ids]
+            )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            pending, failing, oldest = self._conn.execute(
+                "SELECT count(*), count(last_error), min(created_at) FROM outbox"
+            ).fetchone()
+        return {
+            "pending": pending,
+            "failing": failing,
+            "oldest_age": round(time.time() - oldest, 3) if oldest else 0.0
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
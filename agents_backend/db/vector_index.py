@@ -0,0 +1,201 @@
+import logging
+import threading
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # Optional: only needed for the "hnsw" index.
+    hnswlib = None
+
+class FlatVectorIndex:
+    """
+    Exact in-memory index: a contiguous float32 matrix searched by brute force.
+    Distances are squared L2, matching the Chroma collection's default "l2" space.
+    """
+    def __init__(self, capacity=1024):
+        self._capacity = capacity
+        self._matrix = None
+        self._norms = None
+        self._ids = []
+        self._rows = {}         # id -> row
+        self.metadata = {}      # id -> agent fields returned on a match
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, ids, vectors, metadatas):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.empty((self._capacity, vectors.shape[1]), dtype=np.float32)
+                self._norms = np.empty(self._capacity, dtype=np.float32)
+            for element_id, vector, metadata in zip(ids, vectors, metadatas):
+                row = self._rows.get(element_id)
+                if row is None:
+                    row = len(self._ids)
+                    if row == self._matrix.shape[0]:
+                        self._grow()
+                    self._ids.append(element_id)
+                    self._rows[element_id] = row
+                self._matrix[row] = vector
+                self._norms[row] = vector @ vector
+                self.metadata[element_id] = metadata
+
+    def _grow(self):
+        size = self._matrix.shape[0] * 2
+        self._matrix = np.resize(self._matrix, (size, self._matrix.shape[1]))
+        self._norms = np.resize(self._norms, size)
+
+    def remove(self, ids):
+        # Swap-remove so the matrix stays contiguous.
+        with self._lock:
+            for element_id in ids:
+                row = self._rows.pop(element_id, None)
+                if row is None:
+                    continue
+                last = len(self._ids) - 1
+                if row != last:
+                    moved = self._ids[last]
+                    self._matrix[row] = self._matrix[last]
+                    self._norms[row] = self._norms[last]
+                    self._ids[row] = moved
+                    self._rows[moved] = row
+                self._ids.pop()
+                self.metadata.pop(element_id, None)
+
+    def search(self, queries, k=1):
+        # Returns, per query, a list of (id, distance) sorted by distance.
+        queries = np.asarray(queries, dtype=np.float32)
+        with self._lock:
+            count = len(self._ids)
+            if count == 0:
+                return [[] for _ in range(len(queries))]
+            matrix = self._matrix[:count]
+            # ||q - x||^2 = ||q||^2 - 2 q.x + ||x||^2
+            distances = (
+                np.einsum("ij,ij->i", queries, queries)[:, None]
+                - 2.0 * queries @ matrix.T
+                + self._norms[:count][None, :]
+            )
+            ids = list(self._ids)
+        k = min(k, count)
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(distances, nearest):
+            ordered = candidates[np.argsort(row[candidates])]
+            results.append([(ids[i], max(float(row[i]), 0.0)) for i in ordered])
+        return results
+
+
+class HnswVectorIndex:
+    """
+    Approximate in-memory index backed by hnswlib, for registries too large to scan.
+    Uses hnswlib's "l2" space (squared L2), like Chroma.
+    """
+    def __init__(self, capacity=10_000, ef_search=64, ef_construction=200, m=16):
+        if hnswlib is None:
+            raise ImportError("hnswlib is required for the hnsw vector index")
+        self._capacity = capacity
+        self._ef_search = ef_search
+        self._ef_construction = ef_construction
+        self._m = m
+        self._index = None
+        self._labels = {}       # id -> int label
+        self._ids = {}          # int label -> id
+        self._next_label = 0
+        self.metadata = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.metadata)
+
+    def _ensure_index(self, dim, needed):
+        if self._index is None:
+            self._index = hnswlib.Index(space="l2", dim=dim)
+            self._index.init_index(
+                max_elements=max(self._capacity, needed),
+                ef_construction=self._ef_construction,
+                M=self._m
+            )
+            self._index.set_ef(self._ef_search)
+        elif needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, self._index.get_max_elements() * 2))
+
+    def add(self, ids, vectors, metadatas):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            labels = []
+            for element_id in ids:
+                label = self._labels.get(element_id)
+                if label is None:
+                    label = self._next_label
+                    self._next_label += 1
+                    self._labels[element_id] = label
+                    self._ids[label] = element_id
+                labels.append(label)
+            self._ensure_index(vectors.shape[1], self._next_label)
+            self._index.add_items(vectors, labels)
+            for element_id, metadata in zip(ids, metadatas):
+                self.metadata[element_id] = metadata
+
+    def remove(self, ids):
+        with self._lock:
+            for element_id in ids:
+                label = self._labels.pop(element_id, None)
+                if label is None:
+                    continue
+                self._index.mark_deleted(label)
+                del self._ids[label]
+                self.metadata.pop(element_id, None)
+
+    def search(self, queries, k=1):
+        queries = np.asarray(queries, dtype=np.float32)
+        with self._lock:
+            count = len(self.metadata)
+            if count == 0:
+                return [[] for _ in range(len(queries))]
+            labels, distances = self._index.knn_query(queries, k=min(k, count))
+            return [
+                [(self._ids[int(label)], float(distance)) for label, distance in zip(row_labels, row_distances)]
+                for row_labels, row_distances in zip(labels, distances)
+            ]
+
+
+def create_vector_index(mode, expected_size, hnsw_threshold):
+    """
+    Returns an in-memory index for `mode` ("flat", "hnsw" or "auto"), or None for "off".
+    "auto" picks the flat matrix below `hnsw_threshold` agents and HNSW above it
+    (falling back to flat when hnswlib is not installed).
+    """
+    if mode == "off":
+        return None
+    if mode == "auto":
+        mode = "hnsw" if expected_size >= hnsw_threshold and hnswlib is not None else "flat"
+    if mode == "hnsw":
+        return HnswVectorIndex(capacity=max(expected_size * 2, 10_000))
+    if mode == "flat":
+        return FlatVectorIndex(capacity=max(expected_size * 2, 1024))
+    raise ValueError(f"Unknown vector index mode: {mode}")
+
+
+def load_index_from_collection(index, collection, batch_size=5000, where=None):
+    # Warm-load every stored embedding (matching `where`, if given) from a Chroma collection, one page at a time.
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings", "metadatas"], where=where, limit=batch_size, offset=offset)
+        ids = page.get("ids") or []
+        if not ids:
+            break
+        index.add(ids, page["embeddings"], [match_fields(metadata) for metadata in page["metadatas"]])
+        offset += len(ids)
+    logging.info("Loaded %d agents into the in-memory vector index", len(index))
+
+
+def match_fields(metadata):
+    metadata = metadata or {}
+    return {
+        "role": metadata.get("role"),
+        "role_description": metadata.get("role_description"),
+        "task_prompt": metadata.get("task_prompt")
+    }
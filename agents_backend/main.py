@@ -1,17 +1,107 @@
+import asyncio
+import json
 import logging
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from services.agent_service import AgentService  # Updated import path
-from typing import Optional  # Add this import
+from typing import List, Optional  # Add this import
+from agents.errors import GenerationQueueFull
+from config import (
+    MAX_BATCH_SIZE,
+    DISCONNECT_POLL_INTERVAL,
+    LOG_LEVEL,
+    READ_PAGE_SIZE,
+    READ_MAX_PAGE_SIZE,
+    SUBTREE_MAX_DEPTH,
+    WARMUP_ON_STARTUP,
+    WARMUP_RETRY_INTERVAL,
+    COMPACTION_DISTANCE_THRESHOLD
+)
+from metrics import render_metrics
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=LOG_LEVEL)
+
+# Global instance of our service, built in the background once the server is up (see lifespan).
+agent_service = None
+readiness = {"ready": False, "warmup": {}, "error": None}
+
+async def start_service():
+    global agent_service
+    try:
+        # Heavy imports (ChromaDB, the embedding runtime) and opening the stores happen
+        # here, off the import path and the event loop.
+        def build():
+            from services.agent_service import AgentService
+            return AgentService()
+
+        agent_service = await asyncio.to_thread(build)
+        agent_service.start()
+    except Exception as e:
+        readiness["error"] = str(e)
+        logging.error(f"Error starting agent service: {str(e)}", exc_info=True)
+        return
+
+    # Retry until the required dependencies are reachable; /ready stays red meanwhile.
+    while True:
+        try:
+            readiness["warmup"] = await agent_service.warm_up(preload_models=WARMUP_ON_STARTUP)
+            break
+        except Exception as e:
+            readiness["error"] = str(e)
+            logging.error(f"Warm-up failed, retrying in {WARMUP_RETRY_INTERVAL}s: {str(e)}")
+            await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+    readiness.update(ready=True, error=None)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup = asyncio.create_task(start_service())
+    try:
+        yield
+    finally:
+        startup.cancel()
+        await asyncio.gather(startup, return_exceptions=True)
+        if agent_service is not None:
+            await agent_service.close()
 
 # Create FastAPI app instance
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+def service():
+    # Requests arriving before the background startup has built the service get a 503.
+    if agent_service is None:
+        raise HTTPException(status_code=503, detail="Service is starting", headers={"Retry-After": "1"})
+    return agent_service
 
-# Global instance of our service
-agent_service = AgentService()
+@app.get("/ready")
+async def ready():
+    # Readiness probe: green once the service is built and warmed up.
+    if not readiness["ready"]:
+        return JSONResponse(status_code=503, content=readiness)
+    return readiness
+
+async def run_until_disconnected(request: Request, coro):
+    # Run the work as a task and cancel it (and any generation it awaits) if the client goes away.
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logging.info("Client disconnected, cancelling request")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        task.cancel()
+
+def overloaded(error: GenerationQueueFull):
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)}
+    )
 
 # Pydantic model for incoming requests
 class ProblemStatementRequest(BaseModel):
@@ -27,7 +117,7 @@ class ProblemStatementRequest(BaseModel):
         }
 
 @app.post("/submit_problem/")
-async def receive_problem(problem: ProblemStatementRequest):
+async def receive_problem(problem: ProblemStatementRequest, request: Request):
     statement = problem.problem_statement.strip()
     parent_id = problem.parent_id.strip() if problem.parent_id else None  # Modified this lin
 
@@ -37,10 +127,243 @@ async def receive_problem(problem: ProblemStatementRequest):
         #raise HTTPException(status_code=400, detail="Parent ID cannot be empty")
 
     try:
-        result = agent_service.process_problem(parent_id, statement)
+        result = await run_until_disconnected(request, service().process_problem(parent_id, statement))
         return result
+    except HTTPException:
+        raise
     except ValueError as ve:  # Add specific handling for ValueError
         raise HTTPException(status_code=400, detail=str(ve))
+    except GenerationQueueFull as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Agent generation timed out")
     except Exception as e:
         logging.error(f"Error processing problem: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+
+def error_event(error: Exception) -> dict:
+    # Streaming equivalent of the status codes used by /submit_problem/.
+    if isinstance(error, ValueError):
+        return {"event": "error", "status": 400, "detail": str(error)}
+    if isinstance(error, GenerationQueueFull):
+        return {"event": "error", "status": 429, "detail": str(error), "retry_after": error.retry_after}
+    if isinstance(error, asyncio.TimeoutError):
+        return {"event": "error", "status": 504, "detail": "Agent generation timed out"}
+    logging.error(f"Error processing problem: {str(error)}", exc_info=error)
+    return {"event": "error", "status": 500, "detail": str(error)}
+
+@app.post("/submit_problem/stream")
+async def receive_problem_stream(problem: ProblemStatementRequest):
+    """
+    NDJSON variant of /submit_problem/: emits the lookup result immediately, then
+    (on a miss) each agent field as the LLM generates it, and finally a "done"
+    event with the persisted agent (or an "error" event). A "retry" event means the
+    generation is being retried and the fields sent so far are void.
+    """
+    statement = problem.problem_statement.strip()
+    parent_id = problem.parent_id.strip() if problem.parent_id else None
+
+    if not statement:
+        raise HTTPException(status_code=400, detail="Problem statement cannot be empty")
+
+    events = asyncio.Queue()
+    current = service()
+
+    async def ndjson():
+        task = asyncio.ensure_future(current.process_problem(parent_id, statement, on_event=events.put))
+        task.add_done_callback(lambda _: events.put_nowait(None))
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield json.dumps(event) + "\n"
+            try:
+                yield json.dumps({"event": "done", **task.result()}) + "\n"
+            except Exception as e:
+                yield json.dumps(error_event(e)) + "\n"
+        finally:
+            # Also runs when the client disconnects mid-stream.
+            task.cancel()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+# Pydantic model for batched submissions
+class ProblemBatchRequest(BaseModel):
+    problems: List[ProblemStatementRequest]
+
+@app.post("/submit_problems/")
+async def receive_problems(batch: ProblemBatchRequest, request: Request):
+    if not batch.problems:
+        raise HTTPException(status_code=400, detail="At least one problem statement is required")
+    if len(batch.problems) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch size cannot exceed {MAX_BATCH_SIZE}")
+
+    problems = [
+        (problem.parent_id.strip() if problem.parent_id else None, problem.problem_statement.strip())
+        for problem in batch.problems
+    ]
+
+    try:
+        results = await run_until_disconnected(request, service().process_problems(problems))
+        return {"results": results}
+    except HTTPException:
+        raise
+    except GenerationQueueFull as e:
+        raise overloaded(e)
+    except Exception as e:
+        logging.error(f"Error processing problem batch: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/decompose_problem/")
+async def decompose_problem(problem: ProblemStatementRequest, request: Request):
+    statement = problem.problem_statement.strip()
+    parent_id = problem.parent_id.strip() if problem.parent_id else None
+
+    if not statement:
+        raise HTTPException(status_code=400, detail="Problem statement cannot be empty")
+
+    try:
+        return await run_until_disconnected(request, service().process_decomposition(parent_id, statement))
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except GenerationQueueFull as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Agent generation timed out")
+    except Exception as e:
+        logging.error(f"Error decomposing problem: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/agents/{node_id}")
+async def get_agent(node_id: str):
+    # Works for agents (elementId), super parents (id) and dummy parents (agent_id).
+    node = await service().get_node(node_id)
+    if node is None:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    return node
+
+@app.get("/agents/{node_id}/children")
+async def get_agent_children(
+    node_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(READ_PAGE_SIZE, ge=1, le=READ_MAX_PAGE_SIZE)
+):
+    try:
+        page = await service().get_children(node_id, cursor, limit)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    if page is None:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    return page
+
+@app.get("/agents/{node_id}/subtree")
+async def get_agent_subtree(
+    node_id: str,
+    depth: int = Query(3, ge=1, le=SUBTREE_MAX_DEPTH),
+    cursor: Optional[str] = None,
+    limit: int = Query(READ_PAGE_SIZE, ge=1, le=READ_MAX_PAGE_SIZE)
+):
+    # Agents within `depth` DEPENDS_ON hops, breadth-first (depth, elementId), one page at a time.
+    try:
+        page = await service().get_subtree(node_id, depth, cursor, limit)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    if page is None:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    return page
+
+@app.post("/admin/reset_bootstrap_state/")
+async def reset_bootstrap_state():
+    # Call after wiping the registry so the next submission may create a new super parent.
+    # Also drops cached matches, on every worker.
+    await service().announce_purge()
+    return {"message": "Bootstrap state reset"}
+
+@app.post("/admin/reconcile_index/")
+async def reconcile_index(dry_run: bool = False):
+    # Re-queue graph agents missing from ChromaDB and delete vectors with no graph node.
+    indexer = service().indexer
+    try:
+        return await indexer.reconcile(dry_run=dry_run)
+    except Exception as e:
+        logging.error(f"Error reconciling index: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/compact_registry/")
+async def compact_registry_endpoint(dry_run: bool = True, threshold: float = Query(None, gt=0)):
+    # Merge near-duplicate agents; reports the clusters only unless dry_run=false.
+    # Imported here, like the other registry tools, so the Neo4j and numpy stack stays off the startup path.
+    from services.compaction import compact_registry
+    chroma_db = service().chroma_db
+    try:
+        return await compact_registry(
+            chroma_db, dry_run=dry_run, threshold=threshold if threshold is not None else COMPACTION_DISTANCE_THRESHOLD
+        )
+    except Exception as e:
+        logging.error(f"Error compacting registry: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/invalidate_generation_cache/")
+async def invalidate_generation_cache(model: str = None):
+    # Drop cached generations of one model (all of them without `model`), e.g. after changing its weights.
+    cache = service().agent_creator.generation_cache
+    if cache is None:
+        raise HTTPException(status_code=404, detail="Generation cache is disabled")
+    return {"invalidated": await cache.run_in_executor(cache.invalidate, model)}
+
+@app.get("/admin/export")
+async def export_registry_ndjson(embeddings: bool = False, batch_size: int = Query(1000, ge=1, le=10000)):
+    # Streams the whole registry as NDJSON (see services/registry_io.py for the format).
+    from services.registry_io import export_registry
+    chroma_db = service().chroma_db
+
+    async def ndjson():
+        async for record in export_registry(chroma_db, embeddings, batch_size):
+            yield json.dumps(record) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.post("/admin/import")
+async def import_registry_ndjson(request: Request, batch_size: int = Query(1000, ge=1, le=10000)):
+    # Loads an NDJSON export from the request body as it streams in.
+    from services.registry_io import import_registry
+    async def lines():
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *complete, buffer = buffer.split(b"\n")
+            for line in complete:
+                yield line.decode("utf-8")
+        if buffer:
+            yield buffer.decode("utf-8")
+
+    current = service()
+    try:
+        counts = await import_registry(current.chroma_db, lines(), batch_size)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        logging.error(f"Error importing registry: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    current.reset_bootstrap_state()
+    return {"imported": counts}
+
+@app.get("/cache_stats/")
+async def cache_stats():
+    current = service()
+    generation_cache = current.agent_creator.generation_cache
+    return {
+        "lookup_cache": current.chroma_db.lookup_cache.stats(),
+        "index_outbox": dict(current.outbox.stats(), **current.indexer.stats),
+        "registry_sync": dict(current.registry_sync.stats, version=current.registry_sync.version),
+        "partition_roots": dict(current.partitions.stats, size=len(current.partitions)),
+        "generation_cache": await generation_cache.run_in_executor(generation_cache.stats) if generation_cache else None
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text exposition format.
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,171 @@
+import bisect
+import functools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from config import DEBUG_LOG_SAMPLE_RATE
+
+# Minimal Prometheus text-format metrics; cheap enough to leave on in production.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DISTANCE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 1.0, 1.25, 1.5, 2.0)
+
+_registry = []
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}    # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        # {labels: (cumulative bucket counts including +Inf, sum)}
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        result = {}
+        for key, values in series.items():
+            cumulative, running = [], 0
+            for count in values[:-1]:
+                running += count
+                cumulative.append(running)
+            result[key] = (cumulative, values[-1])
+        return result
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (cumulative, total) in sorted(self.snapshot().items()):
+            for bound, count in zip(self.buckets + ("+Inf",), cumulative):
+                labels = _format_labels(self.labelnames + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative[-1]}")
+        return lines
+
+class CallbackMetric:
+    """Gauge or counter whose values are read from `callback` at scrape time ({labels: value} or a number)."""
+    def __init__(self, name, documentation, metric_type, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+def timed(histogram, **labels):
+    # Decorator recording the duration of a coroutine function, errors included.
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def register_callback(name, documentation, metric_type, callback, labelnames=()):
+    # Replaces an earlier registration of the same name (e.g. a recreated service).
+    _registry[:] = [metric for metric in _registry if metric.name != name]
+    return CallbackMetric(name, documentation, metric_type, callback, labelnames)
+
+def render_metrics():
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def log_sampled(message, *args):
+    # Debug payload logging (raw query results, raw LLM text) for a sample of requests only.
+    if logging.getLogger().isEnabledFor(logging.DEBUG) and random.random() < DEBUG_LOG_SAMPLE_RATE:
+        logging.debug(message, *args)
+
+
+STAGE_LATENCY = Histogram(
+    "registry_stage_latency_seconds",
+    "Latency of each stage of the registry pipeline.",
+    ("stage",)
+)
+REQUEST_LATENCY = Histogram(
+    "registry_request_latency_seconds",
+    "End-to-end latency of registry operations.",
+    ("operation",)
+)
+MATCHES = Counter(
+    "registry_matches_total",
+    "Registry lookups by result (hit = existing agent reused).",
+    ("result",)
+)
+MATCH_DISTANCE = Histogram(
+    "registry_match_distance",
+    "Distance between a problem statement and its nearest stored agent.",
+    buckets=DISTANCE_BUCKETS
+)
+GENERATION_FAILURES = Counter(
+    "agent_generation_failures_total",
+    "Agent generations that produced no usable agent.",
+    ("kind",)
+)
@@ -1,75 +1,305 @@
+import asyncio
+import base64
+import json
 import logging
+import time
+import uuid
 from db.neo4j_db import (
-    create_parent_agent_node,    # Used to create a new parent node if one doesn't exist.
-    ensure_agent_node_exists,
-    create_agent_node,
-    create_relationship,
-    get_agent_node_by_elementId,
+    ensure_schema,
+    verify_connectivity,
     check_agents_exist,
-    create_super_parent_node
-      # Helper to retrieve an Agent node by its element id.
+    create_super_parent_node,
+    register_agent,
+    register_agents_batch,
+    register_decomposition,
+    get_registry_node,
+    get_agents_by_ids,
+    get_children_page,
+    get_subtree_page,
+    stamp_indexed_agents,
+    bump_purged_version,
+    close_driver
 )
-from db.chroma_db import ChromaDBManager
-from agents.agent_creation import AgentCreator
-from typing import Optional
+from db.chroma_db import ChromaDBManager, MISS, SIMILARITY_THRESHOLD, embedding_distance, cache_key
+from db.outbox import IndexOutbox, DEFAULT_OUTBOX_PATH
+from agents.agent_creation import AgentCreator, GenerationQueueFull
+from services.indexer import VectorIndexer
+from services.registry_sync import RegistrySync
+from services.partitions import PartitionResolver
+from config import (
+    SINGLE_FLIGHT_SEMANTIC,
+    INDEXING_MODE,
+    OUTBOX_PATH,
+    NEO4J_SCHEMA_BOOTSTRAP,
+    SPECULATIVE_GENERATION,
+    SPECULATIVE_MAX_IN_FLIGHT
+)
+from metrics import STAGE_LATENCY, REQUEST_LATENCY, MATCHES, register_callback, timed
+from typing import List, Optional, Tuple
+
 class AgentService:
-    def __init__(self):
-        self.chroma_db = ChromaDBManager()    
-        self.agent_creator = AgentCreator()   
+    def __init__(self, chroma_db=None, agent_creator=None):
+        self.chroma_db = chroma_db or ChromaDBManager()
+        self.agent_creator = agent_creator or AgentCreator()
+        # New agents reach ChromaDB through a durable outbox drained in the background.
+        self.outbox = IndexOutbox(OUTBOX_PATH or DEFAULT_OUTBOX_PATH)
+        self.indexer = VectorIndexer(self.chroma_db, self.outbox)
+        # Picks up agents indexed or deleted by other workers.
+        self.registry_sync = RegistrySync(self.chroma_db, on_purge=self._forget_cached_state)
+        # Parent id -> root of its tree, when lookups are partitioned by tree.
+        self.partitions = PartitionResolver()
+        # Once the registry holds an agent it stays non-empty, so the first positive answer is cached.
+        self._agents_exist = False
+        # Normalized statement -> resolution currently in progress.
+        self._in_flight = {}
+        # Speculative generations currently running, and what became of them.
+        self._speculating = 0
+        self.speculation_stats = {"started": 0, "used": 0, "cancelled": 0, "skipped": 0}
+        self._register_metrics()
+
+    def _register_metrics(self):
+        # Gauges and counters owned by other components, read at scrape time.
+        scheduler = self.agent_creator.scheduler
+        register_callback(
+            "generation_queue_depth", "LLM generations by scheduler state.", "gauge",
+            lambda: {"active": scheduler.active, "waiting": scheduler.waiting}, ("state",)
+        )
+        register_callback(
+            "agent_generation_events_total", "LLM generation attempts, repairs and retries.", "counter",
+            lambda: dict(self.agent_creator.stats), ("event",)
+        )
+        register_callback(
+            "registry_in_flight_statements", "Statements currently being resolved (single-flight leaders).", "gauge",
+            lambda: len(self._in_flight)
+        )
+        register_callback(
+            "speculative_generation_events_total",
+            "Speculative generations started, used on a miss, cancelled on a match or skipped for lack of capacity.",
+            "counter", lambda: dict(self.speculation_stats), ("event",)
+        )
+        lookup_cache = self.chroma_db.lookup_cache
+        register_callback(
+            "lookup_cache_events_total", "Lookup cache results.", "counter",
+            lambda: {key: value for key, value in lookup_cache.stats().items()
+                     if key in ("hits", "negative_hits", "misses")},
+            ("result",)
+        )
+        register_callback(
+            "index_outbox_pending", "Agents waiting to be written to the vector store.", "gauge",
+            lambda: self.outbox.stats()["pending"]
+        )
+        embedding_function = self.chroma_db.embedding_function
+        if hasattr(embedding_function, "hits"):
+            register_callback(
+                "embedding_cache_events_total", "Embedding cache results.", "counter",
+                lambda: {"hits": embedding_function.hits, "misses": embedding_function.misses}, ("result",)
+            )
+
+        generation_cache = self.agent_creator.generation_cache
+        if generation_cache is not None:
+            register_callback(
+                "generation_cache_events_total", "Generation cache results.", "counter",
+                lambda: {"hits": generation_cache.hits, "misses": generation_cache.misses}, ("result",)
+            )
+
+    def start(self):
+        # Starts background work; needs a running event loop.
+        self.indexer.start()
+        self.registry_sync.start()
+
+    async def warm_up(self, preload_models: bool = True) -> dict:
+        """
+        Get ready for traffic: check Neo4j (creating the schema if NEO4J_SCHEMA_BOOTSTRAP),
+        load the in-memory vector index and, with preload_models, the embedding model
+        and the Ollama model. Returns {step: seconds or error}. Raises if Neo4j, the
+        index or the embedding model fail; an Ollama failure is only reported, since
+        generation has its own timeouts.
+        """
+        steps = {}
+
+        async def step(name, func, required=True):
+            started = time.perf_counter()
+            try:
+                await func()
+            except Exception as e:
+                steps[name] = f"error: {e}"
+                if required:
+                    raise
+                logging.warning("Warm-up step %s failed: %s", name, str(e))
+                return
+            steps[name] = round(time.perf_counter() - started, 3)
+
+        await step("neo4j", ensure_schema if NEO4J_SCHEMA_BOOTSTRAP else verify_connectivity)
+        await step("registry_version", self.registry_sync.prime)
+        await step("vector_index", lambda: self.chroma_db.run_in_executor(self.chroma_db.load_vector_index))
+        if preload_models:
+            await step("embedding_model", lambda: self.chroma_db.run_in_executor(self.chroma_db.load_embedding_model))
+            await step("ollama_model", self.agent_creator.warm_up, required=False)
+        logging.info("Warm-up finished: %s", steps)
+        return steps
+
+    async def agents_exist(self) -> bool:
+        if not self._agents_exist:
+            with STAGE_LATENCY.time(stage="neo4j_bootstrap_check"):
+                self._agents_exist = await check_agents_exist()
+        return self._agents_exist
+
+    def reset_bootstrap_state(self):
+        # Called by admin resets that may have emptied the registry.
+        self._agents_exist = False
 
-    def process_problem(self, parent_id: Optional[str], statement: str) -> dict:
+    def _forget_cached_state(self):
+        self.reset_bootstrap_state()
+        self.partitions.clear()
 
-        agents_exist = check_agents_exist()
+    async def announce_purge(self):
+        # After agents were deleted or the registry wiped: every worker, this one
+        # included, drops its cached matches, partition roots and bootstrap state.
+        self.chroma_db.lookup_cache.clear()
+        self._forget_cached_state()
+        await bump_purged_version()
+
+    @timed(REQUEST_LATENCY, operation="process_problem")
+    async def process_problem(self, parent_id: Optional[str], statement: str, on_event=None) -> dict:
+        """
+        Map the statement to an existing or newly generated agent under parent_id.
+        If given, on_event is awaited with progress events: the lookup result as
+        soon as it is known and, on a miss, each agent field as it is generated.
+        """
+
+        agents_exist = await self.agents_exist()
         if agents_exist and not parent_id:
             raise ValueError("parent_id is required when agents exist in the system")
-    
-        if not agents_exist and not parent_id:
-            parent_id = create_super_parent_node()
+        if self.partitions.enabled and not parent_id:
+            # The registry's first agent: its tree's root must exist to scope the lookup.
+            parent_id = await create_super_parent_node()
             logging.info(f"Created super parent node with ID: {parent_id}")
-        # First check if parent exists as an Agent
-        existing_parent = get_agent_node_by_elementId(parent_id)
-        
-        if not existing_parent:
-            # If not an Agent, create/ensure parent as DummyAgent
-            parent_agent = {
-                "agent_id": parent_id,
-                "problem_statement": statement
-            }
-            create_parent_agent_node(parent_agent)
-            logging.debug(f"Created DummyAgent parent with id: {parent_id}")
-
-        # Check ChromaDB for similar agent
-        similar_agent = self.chroma_db.retrieve_agent_by_problem(statement)
-        if similar_agent:
-            logging.info(f"Similar agent found: {similar_agent}")
-            # Ensure the similar agent exists in Neo4j
-            ensure_agent_node_exists(similar_agent)
-            # Create relationship
-            create_relationship(parent_id, similar_agent["elementId"])
+        partition = (await self.partitions.resolve([parent_id]))[0] if parent_id else None
+
+        # Single-flight: identical (or, optionally, similar) statements already being
+        # resolved (in the same partition) are awaited instead of triggering another
+        # lookup and generation.
+        key = cache_key(statement, partition)
+        while True:
+            flight, embedding = await self._find_in_flight(key, statement, partition)
+            if flight is None:
+                break
+            await asyncio.wait({flight.future})
+            if flight.future.cancelled():
+                continue    # The leading request was cancelled; try to lead instead.
+            agent = flight.future.result()    # Re-raises the leader's error.
+            logging.info(f"Joined in-flight resolution for statement, agent: {agent['elementId']}")
+            MATCHES.inc(result="in_flight")
+            await _emit(on_event, {"event": "lookup", "match": True, "agent": agent})
+            await self._register(parent_id, statement, agent)
             return {
                 "message": "Existing agent found and mapped",
                 "problem_statement": statement,
-                "agent": similar_agent
+                "agent": agent
             }
 
-        # Generate new agent only if no similar agent found
-        new_agent = self.agent_creator.generate_agent(statement)
+        flight = _InFlight(asyncio.get_running_loop().create_future(), embedding, partition)
+        self._in_flight[key] = flight
+        try:
+            if SINGLE_FLIGHT_SEMANTIC and flight.embedding is None:
+                flight.embedding = (await self.chroma_db.run_in_executor(self.chroma_db.embed, [statement]))[0]
+            result = await self._resolve_and_register(parent_id, statement, on_event, partition)
+            flight.future.set_result(result["agent"])
+            return result
+        except asyncio.CancelledError:
+            flight.future.cancel()
+            raise
+        except Exception as e:
+            flight.future.set_exception(e)
+            flight.future.exception()    # Mark retrieved; followers still see it via result().
+            raise
+        finally:
+            if self._in_flight.get(key) is flight:
+                del self._in_flight[key]
+
+    async def _find_in_flight(self, key: str, statement: str, partition: Optional[str] = None):
+        flight = self._in_flight.get(key)
+        if flight or not SINGLE_FLIGHT_SEMANTIC or not self._in_flight:
+            return flight, None
+
+        embedding = (await self.chroma_db.run_in_executor(self.chroma_db.embed, [statement]))[0]
+        if key in self._in_flight:    # An identical statement started while we were embedding.
+            return self._in_flight[key], embedding
+        candidates = [
+            (embedding_distance(embedding, other.embedding), other)
+            for other in self._in_flight.values()
+            if other.embedding is not None and other.partition == partition
+        ]
+        if candidates:
+            distance, closest = min(candidates, key=lambda candidate: candidate[0])
+            if distance <= SIMILARITY_THRESHOLD:
+                return closest, embedding
+        return None, embedding
+
+    async def _resolve_and_register(self, parent_id: Optional[str], statement: str, on_event=None,
+                                    partition: Optional[str] = None) -> dict:
+        # Streamed fields go through a relay so a speculative generation cannot emit
+        # them before the lookup result.
+        on_field = _FieldRelay() if on_event is not None else None
+        speculation = None
+        try:
+            # Check the lookup cache, then ChromaDB, for a similar agent
+            similar_agent = self.chroma_db.lookup_cached(statement, partition)
+            if similar_agent is MISS:
+                speculation = self._speculate(statement, on_field)
+                # Includes time spent waiting for an executor thread.
+                with STAGE_LATENCY.time(stage="lookup"):
+                    similar_agent = await self.chroma_db.run_in_executor(
+                        self.chroma_db.retrieve_agent_by_problem, statement, use_cache=False, partition=partition
+                    )
+            similar_agent = (await self._hydrate([statement], [similar_agent], [partition]))[0]
+            MATCHES.inc(result="hit" if similar_agent else "miss")
+            await _emit(on_event, {"event": "lookup", "match": bool(similar_agent), "agent": similar_agent})
+            if similar_agent:
+                if speculation is not None:
+                    speculation.cancel()
+                    self.speculation_stats["cancelled"] += 1
+                logging.info(f"Similar agent found: {similar_agent}")
+                # Resolve the parent, ensure the agent node and map it in one transaction
+                await self._register(parent_id, statement, similar_agent)
+                return {
+                    "message": "Existing agent found and mapped",
+                    "problem_statement": statement,
+                    "agent": similar_agent
+                }
+
+            # Generate new agent only if no similar agent found (or take the speculative one)
+            if on_field is not None:
+                async def forward(name, value):
+                    if name is None:
+                        # The generation is retried: fields sent so far are replaced.
+                        await on_event({"event": "retry", "attempt": value})
+                    elif name in STREAMED_FIELDS:
+                        await on_event({"event": "field", "name": name, "value": value})
+                await on_field.attach(forward)
+            with STAGE_LATENCY.time(stage="generation"):
+                if speculation is not None:
+                    self.speculation_stats["used"] += 1
+                    new_agent = await speculation
+                else:
+                    new_agent = await self.agent_creator.generate_agent(statement, on_field=on_field)
+        finally:
+            # Errors and client disconnects must not leave a generation running.
+            if speculation is not None and not speculation.done():
+                speculation.cancel()
         if not new_agent:
             raise Exception("Agent creation failed")
 
         # Add problem statement and clean up
         new_agent["problem_statement"] = statement
         new_agent.pop("agent_id", None)
+        new_agent["elementId"] = str(uuid.uuid4())
+        if partition:
+            new_agent["partition"] = partition
 
-        # Create Neo4j node and get elementId
-        elementId = create_agent_node(new_agent)
-        new_agent["elementId"] = elementId
-
-        # Store in ChromaDB
-        self.chroma_db.store_agent(new_agent)
-
-        # Create relationship
-        create_relationship(parent_id, elementId)
+        # Create parent, Neo4j node and relationship in one transaction, then index the agent
+        registered = await self._write_and_index([new_agent], lambda: self._register(parent_id, statement, new_agent))
+        elementId = registered["elementId"]
 
         return {
             "message": "New agent created and mapped",
@@ -82,4 +312,394 @@ class AgentService:
             }
         }
 
+    async def _hydrate(self, statements: List[str], matches: List[Optional[dict]],
+                       partitions: Optional[List[Optional[str]]] = None) -> List[Optional[dict]]:
+        """
+        Fill in matches that lack agent fields (compact ChromaDB records) with one
+        batched graph read; a match whose agent is gone from the graph becomes a miss.
+        Hydrated results replace the statements' lookup cache entries.
+        """
+        partial = [index for index, match in enumerate(matches) if match and match.get("task_prompt") is None]
+        if not partial:
+            return matches
+        with STAGE_LATENCY.time(stage="hydrate"):
+            agents = await get_agents_by_ids({matches[index]["elementId"] for index in partial})
+        matches = list(matches)
+        partitions = partitions or [None] * len(statements)
+        for index in partial:
+            agent = agents.get(matches[index]["elementId"])
+            matches[index] = {field: agent.get(field) for field in MATCH_FIELDS} if agent else None
+            self.chroma_db.lookup_cache.put(cache_key(statements[index], partitions[index]), matches[index])
+        return matches
+
+    def _speculate(self, statement: str, on_field=None):
+        # Starts generating an agent for `statement` while the lookup runs, if speculation
+        # is enabled and a generation slot is idle; returns the task or None.
+        if not SPECULATIVE_GENERATION:
+            return None
+        if self._speculating >= SPECULATIVE_MAX_IN_FLIGHT or not self.agent_creator.scheduler.has_idle_slot():
+            self.speculation_stats["skipped"] += 1
+            return None
+        self._speculating += 1
+        self.speculation_stats["started"] += 1
+        task = asyncio.create_task(self.agent_creator.generate_agent(statement, on_field=on_field))
+
+        def done(task):
+            self._speculating -= 1
+            if not task.cancelled():
+                task.exception()    # Retrieved here in case the result is discarded.
+        task.add_done_callback(done)
+        return task
+
+    async def _register(self, parent_id: Optional[str], statement: str, agent: dict) -> dict:
+        with STAGE_LATENCY.time(stage="neo4j_register"):
+            registered = await register_agent(parent_id, statement, _graph_properties(agent))
+        self._agents_exist = True
+        if registered["parent_created"]:
+            logging.info(f"Created super parent node with ID: {registered['parent_id']}")
+        return registered
+
+    async def _write_and_index(self, new_agents: List[dict], write):
+        """
+        Run the graph write `write()` and get `new_agents` into the vector store.
+        In outbox mode the agents are queued durably before the write and indexed in
+        the background (entries whose write never lands are dropped by the indexer);
+        in sync mode they are stored after the write, before returning.
+        """
+        if INDEXING_MODE != "outbox":
+            result = await write()
+            if new_agents:
+                await self.chroma_db.run_in_executor(self.chroma_db.store_agents, new_agents)
+                try:
+                    await stamp_indexed_agents([agent["elementId"] for agent in new_agents])
+                except Exception as e:
+                    # Other workers then only see the agents once their cache entries expire.
+                    logging.warning("Could not stamp indexed agents: %s", str(e))
+            return result
+
+        if new_agents:
+            await self.chroma_db.run_in_executor(self.outbox.enqueue, new_agents)
+        result = await write()
+        if new_agents:
+            # Identical statements match immediately, before the batch is indexed.
+            self.chroma_db.cache_agents(new_agents)
+            self.indexer.notify()
+        return result
+
+    @timed(REQUEST_LATENCY, operation="process_problems")
+    async def process_problems(self, problems: List[Tuple[Optional[str], str]]) -> List[dict]:
+        """
+        Process a batch of (parent_id, statement) pairs.
+        Uses one Chroma query for the whole batch, one batched vector write for the new
+        agents and one graph transaction for all nodes and edges. Results are
+        returned per item, in order; item-level failures are reported inline.
+        """
+        results: List[Optional[dict]] = [None] * len(problems)
+        pending = []
+
+        for index, (parent_id, statement) in enumerate(problems):
+            if not statement:
+                results[index] = _item_error(index, "Problem statement cannot be empty")
+            else:
+                pending.append((index, parent_id, statement))
+
+        # Resolve missing parent ids the same way process_problem does, creating at most one super parent.
+        if any(not parent_id for _, parent_id, _ in pending):
+            agents_exist = await self.agents_exist()
+            super_parent_id = None
+            resolved = []
+            for index, parent_id, statement in pending:
+                if not parent_id and agents_exist:
+                    results[index] = _item_error(index, "parent_id is required when agents exist in the system")
+                    continue
+                if not parent_id:
+                    if super_parent_id is None:
+                        super_parent_id = await create_super_parent_node()
+                        logging.info(f"Created super parent node with ID: {super_parent_id}")
+                    parent_id = super_parent_id
+                resolved.append((index, parent_id, statement))
+            pending = resolved
+
+        if not pending:
+            return results
+
+        statements = [statement for _, _, statement in pending]
+        partitions = await self.partitions.resolve([parent_id for _, parent_id, _ in pending])
+
+        # One multi-text query for the whole batch (one per tree when partitioned).
+        with STAGE_LATENCY.time(stage="lookup"):
+            matches = await self.chroma_db.run_in_executor(
+                self.chroma_db.retrieve_agents_by_problems, statements, True, partitions
+            )
+            matches = await self._hydrate(statements, matches, partitions)
+
+        for match in matches:
+            MATCHES.inc(result="hit" if match else "miss")
+
+        # Generate each distinct unmatched (statement, partition) once, concurrently.
+        to_generate = list(dict.fromkeys(
+            (statement, partition) for statement, partition, match in zip(statements, partitions, matches) if not match
+        ))
+        # Batch items are admitted against the remaining queue capacity, in order;
+        # those that don't fit get a per-item "queue full" error.
+        with STAGE_LATENCY.time(stage="generation"):
+            generated = await asyncio.gather(
+                *(self.agent_creator.generate_agent(statement) for statement, _ in to_generate),
+                return_exceptions=True
+            )
+        new_agents = {}
+        failures = {}
+        rejected = None
+        for (statement, partition), new_agent in zip(to_generate, generated):
+            if isinstance(new_agent, asyncio.TimeoutError):
+                failures[statement, partition] = "Agent generation timed out"
+                continue
+            if isinstance(new_agent, GenerationQueueFull):
+                failures[statement, partition] = str(new_agent)
+                rejected = new_agent
+                continue
+            if isinstance(new_agent, BaseException) or not new_agent:
+                logging.error("Agent creation failed for statement %r: %s", statement, new_agent)
+                continue
+            new_agent["problem_statement"] = statement
+            new_agent.pop("agent_id", None)
+            new_agent["elementId"] = str(uuid.uuid4())
+            if partition:
+                new_agent["partition"] = partition
+            new_agents[statement, partition] = new_agent
+
+        rows = []
+        mapped = []
+        for (index, parent_id, statement), partition, match in zip(pending, partitions, matches):
+            agent = match or new_agents.get((statement, partition))
+            if not agent:
+                results[index] = _item_error(index, failures.get((statement, partition), "Agent creation failed"))
+                continue
+            rows.append({
+                "parent_id": parent_id,
+                "problem_statement": statement,
+                "agent": _graph_properties(agent)
+            })
+            mapped.append((index, statement, agent, match is not None))
+        if rejected and not rows:
+            # Nothing in the batch could be answered: overloaded as a whole.
+            raise rejected
+
+        # Graph first, then the vector store, mirroring process_problem.
+        async def write():
+            with STAGE_LATENCY.time(stage="neo4j_register"):
+                await register_agents_batch(rows)
+
+        await self._write_and_index(list(new_agents.values()), write)
+        if rows:
+            self._agents_exist = True
+
+        for index, statement, agent, existing in mapped:
+            results[index] = {
+                "index": index,
+                "status": "ok",
+                "message": "Existing agent found and mapped" if existing else "New agent created and mapped",
+                "problem_statement": statement,
+                "agent": {
+                    "elementId": agent["elementId"],
+                    "role": agent.get("role"),
+                    "role_description": agent.get("role_description"),
+                    "task_prompt": agent.get("task_prompt")
+                }
+            }
+        return results
+
+    @timed(REQUEST_LATENCY, operation="process_decomposition")
+    async def process_decomposition(self, parent_id: Optional[str], statement: str) -> dict:
+        """
+        Decompose the statement into subagents with one LLM call, match all of them
+        with one batched registry query, persist only the unmatched ones and write
+        every parent and inter-subagent DEPENDS_ON edge in one graph transaction.
+        """
+        agents_exist = await self.agents_exist()
+        if agents_exist and not parent_id:
+            raise ValueError("parent_id is required when agents exist in the system")
+
+        with STAGE_LATENCY.time(stage="generation"):
+            subagents = await self.agent_creator.decompose_problem(statement)
+        if not subagents:
+            raise Exception("Problem decomposition failed")
+
+        # Created before the lookup so the lookup can be scoped to the new tree.
+        if not parent_id:
+            parent_id = await create_super_parent_node()
+            logging.info(f"Created super parent node with ID: {parent_id}")
+        partition = (await self.partitions.resolve([parent_id]))[0]
+
+        statements = [subagent["problem_statement"] or subagent["role"] for subagent in subagents]
+        partitions = [partition] * len(statements) if partition else None
+        matches = await self.chroma_db.run_in_executor(
+            self.chroma_db.retrieve_agents_by_problems, statements, True, partitions
+        )
+        matches = await self._hydrate(statements, matches, partitions)
+
+        agents = []
+        new_agents = []
+        for subagent, match in zip(subagents, matches):
+            MATCHES.inc(result="hit" if match else "miss")
+            if match:
+                agents.append(dict(match, existing=True))
+                continue
+            new_agent = {key: value for key, value in subagent.items() if key != "depends_on"}
+            new_agent["elementId"] = str(uuid.uuid4())
+            if partition:
+                new_agent["partition"] = partition
+            new_agents.append(new_agent)
+            agents.append(dict(new_agent, existing=False))
+
+        # Dependencies are given by role; map them onto the resolved elementIds.
+        by_role = {subagent["role"].strip().lower(): agent["elementId"] for subagent, agent in zip(subagents, agents)}
+        dependencies = []
+        for subagent, agent in zip(subagents, agents):
+            depends_on = subagent.get("depends_on") or []
+            agent["depends_on"] = []
+            for role in depends_on if isinstance(depends_on, list) else []:
+                target = by_role.get(str(role).strip().lower())
+                if target and target != agent["elementId"] and target not in agent["depends_on"]:
+                    agent["depends_on"].append(target)
+                    dependencies.append({"from": agent["elementId"], "to": target})
+
+        rows = [
+            {"parent_id": parent_id, "problem_statement": statement, "agent": _graph_properties(agent)}
+            for agent in {agent["elementId"]: agent for agent in agents}.values()
+        ]
+        async def write():
+            with STAGE_LATENCY.time(stage="neo4j_register"):
+                await register_decomposition(rows, dependencies)
+
+        await self._write_and_index(new_agents, write)
+        self._agents_exist = True
+
+        return {
+            "message": f"Problem decomposed into {len(agents)} agents ({len(new_agents)} new)",
+            "problem_statement": statement,
+            "parent_id": parent_id,
+            "agents": [
+                {key: agent.get(key) for key in
+                 ("elementId", "role", "role_description", "task_prompt", "existing", "depends_on")}
+                for agent in agents
+            ]
+        }
+
+    async def get_node(self, node_id: str) -> Optional[dict]:
+        node = await get_registry_node(node_id)
+        if node is not None:
+            node["id"] = node_id
+        return node
+
+    async def get_children(self, node_id: str, cursor: Optional[str], limit: int) -> Optional[dict]:
+        """One page of node_id's direct children; None if the node does not exist."""
+        after = _decode_cursor(cursor) if cursor else None
+        if after is not None and not isinstance(after, str):
+            raise ValueError("Invalid cursor")
+        children = await get_children_page(node_id, after, limit + 1)
+        if not children and await get_registry_node(node_id) is None:
+            return None
+        page = children[:limit]
+        return {
+            "id": node_id,
+            "items": page,
+            "next_cursor": _encode_cursor(page[-1]["elementId"]) if len(children) > limit else None
+        }
+
+    async def get_subtree(self, node_id: str, depth: int, cursor: Optional[str], limit: int) -> Optional[dict]:
+        """One page of the agents within `depth` hops of node_id; None if the node does not exist."""
+        after = _decode_cursor(cursor) if cursor else None
+        if after is not None and not (isinstance(after, list) and len(after) == 2
+                                      and isinstance(after[0], int) and isinstance(after[1], str)):
+            raise ValueError("Invalid cursor")
+        rows = await get_subtree_page(node_id, depth, after, limit + 1)
+        if not rows and await get_registry_node(node_id) is None:
+            return None
+        page = rows[:limit]
+        return {
+            "id": node_id,
+            "depth": depth,
+            "items": page,
+            "next_cursor": (
+                _encode_cursor([page[-1]["depth"], page[-1]["agent"]["elementId"]]) if len(rows) > limit else None
+            )
+        }
+
+    async def close(self):
+        await self.indexer.stop()
+        await self.registry_sync.stop()
+        self.agent_creator.close()
+        self.outbox.close()
+        self.chroma_db.close()
+        await close_driver()
+
+
+# Agent fields returned for a registry match.
+MATCH_FIELDS = ("elementId", "role", "role_description", "task_prompt")
+
+# Generated fields forwarded to streaming clients.
+STREAMED_FIELDS = ("role", "role_description", "task_prompt")
+
+
+class _FieldRelay:
+    """
+    on_field callback that buffers generated fields until a target is attached,
+    then replays them and forwards the rest. A retry marker (name None) received
+    before that drops the buffered fields instead.
+    """
+    def __init__(self):
+        self._buffer = []
+        self._target = None
+
+    async def __call__(self, name, value):
+        if self._target is None:
+            if name is None:
+                self._buffer.clear()
+            else:
+                self._buffer.append((name, value))
+        else:
+            await self._target(name, value)
+
+    async def attach(self, target):
+        while self._buffer:
+            await target(*self._buffer.pop(0))
+        self._target = target
+
+
+async def _emit(on_event, event: dict):
+    if on_event is not None:
+        await on_event(event)
+
+
+class _InFlight:
+    # A statement resolution other requests can wait on.
+    __slots__ = ("future", "embedding", "partition")
+
+    def __init__(self, future, embedding=None, partition=None):
+        self.future = future
+        self.embedding = embedding
+        self.partition = partition
+
+
+def _encode_cursor(value) -> str:
+    # Opaque keyset cursor: the sort key of the last row returned.
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def _item_error(index: int, error: str) -> dict:
+    return {"index": index, "status": "error", "error": error}
+
 
+def _graph_properties(agent: dict) -> dict:
+    # Node properties for an Agent; only primitive fields are copied.
+    keys = ("elementId", "problem_statement", "role", "role_description",
+            "task_prompt", "creation_timestamp", "llm_used", "partition")
+    return {key: agent[key] for key in keys if agent.get(key) is not None}
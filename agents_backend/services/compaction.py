@@ -0,0 +1,223 @@
+"""
+Near-duplicate compaction of the agent registry.
+
+Agents whose embeddings lie within COMPACTION_DISTANCE_THRESHOLD of each other are
+clustered (tiled vectorized pairwise distances plus union-find). Within a cluster the
+oldest agent is kept and every agent within the threshold of it is folded into it:
+its DEPENDS_ON edges are moved to the canonical agent and it is deleted from ChromaDB
+and Neo4j. The rest of the cluster is planned again the same way, so an agent is never
+merged into one farther away than the threshold, however the cluster is chained.
+With VECTOR_PARTITIONING=tree, agents are only clustered within their partition, so
+a tree's agents are never folded into another tree's.
+Dry runs (the default) only report the clusters. Run from the agents_backend
+directory, or use POST /admin/compact_registry/:
+
+    python -m services.compaction            # dry run
+    python -m services.compaction --apply
+"""
+import argparse
+import asyncio
+import json
+import logging
+import numpy as np
+from db.neo4j_db import get_existing_agent_ids, merge_duplicate_agents, bump_purged_version, close_driver
+from config import COMPACTION_DISTANCE_THRESHOLD, COMPACTION_BLOCK_SIZE, VECTOR_PARTITIONING
+
+# Duplicates merged per graph transaction.
+MERGE_BATCH_SIZE = 500
+
+def find_duplicate_clusters(vectors, threshold, block_size=COMPACTION_BLOCK_SIZE):
+    """
+    Groups the rows of `vectors` that are within squared L2 distance `threshold` of
+    each other, transitively. Distances are computed one `block_size` x `block_size`
+    tile at a time (upper triangle only), so memory stays bounded by the tile; returns
+    a list of row-index lists with 2+ members.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    count = len(vectors)
+    parent = list(range(count))
+
+    def find(row):
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+
+    norms = np.einsum("ij,ij->i", vectors, vectors)
+    for start in range(0, count, block_size):
+        end = min(start + block_size, count)
+        for column_start in range(start, count, block_size):
+            column_end = min(column_start + block_size, count)
+            # ||a - b||^2 = ||a||^2 - 2 a.b + ||b||^2, for one tile of rows against columns.
+            distances = (norms[start:end, None]
+                         - 2.0 * vectors[start:end] @ vectors[column_start:column_end].T
+                         + norms[None, column_start:column_end])
+            rows, columns = np.nonzero(distances <= threshold)
+            for row, column in zip(rows + start, columns + column_start):
+                if column > row:
+                    a, b = find(row), find(column)
+                    if a != b:
+                        parent[b] = a
+
+    clusters = {}
+    for row in range(count):
+        clusters.setdefault(find(row), []).append(row)
+    return [rows for rows in clusters.values() if len(rows) > 1]
+
+
+def plan_merges(members, vectors, threshold):
+    """
+    Splits one cluster (rows in canonical order) into (canonical, duplicates) merges in
+    which every duplicate is within `threshold` of its canonical: the first remaining
+    row takes every remaining row close enough to it, and the rest is planned again.
+    """
+    plan = []
+    remaining = list(members)
+    while len(remaining) > 1:
+        canonical, others = remaining[0], remaining[1:]
+        distances = np.sum((vectors[others] - vectors[canonical]) ** 2, axis=1)
+        duplicates = [row for row, distance in zip(others, distances) if distance <= threshold]
+        if duplicates:
+            plan.append((canonical, duplicates))
+        remaining = [row for row, distance in zip(others, distances) if distance > threshold]
+    return plan
+
+
+def _load_embeddings(chroma_db, batch_size=5000):
+    # Ids, a float32 matrix filled page by page, and only the metadata compaction uses.
+    ids, metadatas = [], []
+    vectors = None
+    for page_ids, page_vectors, page_metadatas in chroma_db.iter_embeddings(batch_size):
+        page_vectors = np.asarray(page_vectors, dtype=np.float32)
+        if vectors is None:
+            vectors = np.empty((chroma_db.agents_collection.count(), page_vectors.shape[1]), dtype=np.float32)
+        if len(ids) + len(page_ids) > len(vectors):
+            # Agents were added while paging.
+            vectors = np.concatenate([vectors, np.empty((len(page_ids), vectors.shape[1]), dtype=np.float32)])
+        vectors[len(ids):len(ids) + len(page_ids)] = page_vectors
+        ids.extend(page_ids)
+        metadatas.extend(
+            {key: (metadata or {}).get(key) for key in ("role", "creation_timestamp", "partition")}
+            for metadata in page_metadatas
+        )
+    if vectors is None:
+        return [], np.empty((0, 0), dtype=np.float32), []
+    return ids, vectors[:len(ids)], metadatas
+
+
+def _canonical_order(metadata, element_id):
+    # The oldest agent wins (its id is the one most likely held by clients); ties by id.
+    timestamp = (metadata or {}).get("creation_timestamp")
+    return (timestamp if isinstance(timestamp, (int, float)) else float("inf"), element_id)
+
+
+def _partition_clusters(vectors, metadatas, threshold, block_size):
+    # Clusters computed separately for each partition's rows (untagged agents form one group).
+    groups = {}
+    for row, metadata in enumerate(metadatas):
+        groups.setdefault(metadata.get("partition"), []).append(row)
+    clusters = []
+    for rows in groups.values():
+        rows = np.asarray(rows)
+        clusters.extend(
+            rows[cluster].tolist() for cluster in find_duplicate_clusters(vectors[rows], threshold, block_size)
+        )
+    return clusters
+
+
+async def compact_registry(chroma_db, dry_run=True, threshold=COMPACTION_DISTANCE_THRESHOLD,
+                           block_size=COMPACTION_BLOCK_SIZE, max_report=100, by_partition=None):
+    """
+    Find near-duplicate clusters and, unless dry_run, merge each into its canonical agent.
+    With by_partition (default: VECTOR_PARTITIONING is "tree"), agents of different
+    partitions are never merged. Returns a report; dry runs list up to `max_report` clusters.
+    """
+    if by_partition is None:
+        by_partition = VECTOR_PARTITIONING == "tree"
+
+    def load():
+        ids, vectors, metadatas = _load_embeddings(chroma_db)
+        if not ids:
+            clusters = []
+        elif by_partition:
+            clusters = _partition_clusters(vectors, metadatas, threshold, block_size)
+        else:
+            clusters = find_duplicate_clusters(vectors, threshold, block_size)
+        return ids, vectors, metadatas, clusters
+
+    ids, vectors, metadatas, clusters = await chroma_db.run_in_executor(load)
+
+    # Vectors without a graph node are left to the index reconciliation.
+    in_graph = await get_existing_agent_ids([ids[row] for rows in clusters for row in rows])
+
+    def plan_all():
+        plan = []
+        for rows in clusters:
+            members = sorted(
+                (row for row in rows if ids[row] in in_graph),
+                key=lambda row: _canonical_order(metadatas[row], ids[row])
+            )
+            plan.extend(plan_merges(members, vectors, threshold))
+        return plan
+
+    plan = await chroma_db.run_in_executor(plan_all)
+
+    report = {
+        "agents": len(ids),
+        "threshold": threshold,
+        "clusters": len(plan),
+        "duplicates": sum(len(duplicates) for _, duplicates in plan),
+        "dry_run": dry_run
+    }
+    if dry_run:
+        report["cluster_details"] = [
+            {
+                "canonical": {"elementId": ids[canonical], "role": (metadatas[canonical] or {}).get("role")},
+                "duplicates": [
+                    {"elementId": ids[row], "role": (metadatas[row] or {}).get("role")} for row in duplicates
+                ]
+            }
+            for canonical, duplicates in plan[:max_report]
+        ]
+        return report
+
+    pairs = [
+        {"duplicate": ids[row], "canonical": ids[canonical]}
+        for canonical, duplicates in plan for row in duplicates
+    ]
+    merged = rewired = 0
+    for start in range(0, len(pairs), MERGE_BATCH_SIZE):
+        batch = pairs[start:start + MERGE_BATCH_SIZE]
+        # Vectors first: a failure in between leaves graph agents without vectors, which
+        # reconciliation re-indexes, never vectors that match deleted agents.
+        await chroma_db.run_in_executor(chroma_db.delete_agents, [pair["duplicate"] for pair in batch])
+        result = await merge_duplicate_agents(batch)
+        merged += result["merged"]
+        rewired += result["rewired_edges"]
+    if pairs:
+        await bump_purged_version()
+        logging.info("Compaction merged %d duplicate agents into %d canonical agents", merged, len(plan))
+    report["merged"] = merged
+    report["rewired_edges"] = rewired
+    return report
+
+
+async def _main(args):
+    from db.chroma_db import ChromaDBManager
+    chroma_db = ChromaDBManager()
+    try:
+        report = await compact_registry(chroma_db, not args.apply, args.threshold, args.block_size)
+        print(json.dumps(report, indent=2))
+    finally:
+        chroma_db.close()
+        await close_driver()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="merge the duplicates (default: dry run)")
+    parser.add_argument("--threshold", type=float, default=COMPACTION_DISTANCE_THRESHOLD)
+    parser.add_argument("--block-size", type=int, default=COMPACTION_BLOCK_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args))
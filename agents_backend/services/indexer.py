@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+from db.neo4j_db import get_agents_page, get_existing_agent_ids, stamp_indexed_agents, bump_purged_version
+from metrics import STAGE_LATENCY
+from config import (
+    INDEXER_BATCH_SIZE,
+    INDEXER_LINGER,
+    INDEXER_POLL_INTERVAL,
+    OUTBOX_ORPHAN_AGE,
+    RECONCILE_INTERVAL
+)
+
+class VectorIndexer:
+    """
+    Drains the index outbox into ChromaDB in the background. Agents are indexed
+    in batches once their graph write is visible; entries whose graph write never
+    happened are dropped after OUTBOX_ORPHAN_AGE seconds. Also runs the periodic
+    graph/vector reconciliation.
+    """
+    def __init__(self, chroma_db, outbox):
+        self.chroma_db = chroma_db
+        self.outbox = outbox
+        self._wake = asyncio.Event()
+        self._tasks = []
+        self._stopping = False
+        self.stats = {"indexed": 0, "failed_batches": 0, "dropped": 0}
+
+    def start(self):
+        if not self._tasks:
+            self._stopping = False
+            self._tasks.append(asyncio.create_task(self._run()))
+            if RECONCILE_INTERVAL > 0:
+                self._tasks.append(asyncio.create_task(self._reconcile_periodically()))
+
+    async def stop(self):
+        # The drain loop exits after one last pass, so queued agents are flushed on shutdown.
+        # (It is stopped by flag: wait_for can swallow a cancellation that races its timeout.)
+        self._stopping = True
+        self._wake.set()
+        for task in self._tasks[1:]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        # Called after an enqueue so the batch is picked up without waiting for the poll.
+        self._wake.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=INDEXER_POLL_INTERVAL)
+                await asyncio.sleep(INDEXER_LINGER)    # Let concurrent requests fill the batch.
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                while await self.drain_once() == INDEXER_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                logging.error("Vector indexer error: %s", str(e), exc_info=True)
+
+    async def drain_once(self):
+        """Index one batch from the outbox; returns the number of entries claimed."""
+        entries = await self.chroma_db.run_in_executor(self.outbox.claim, INDEXER_BATCH_SIZE)
+        if not entries:
+            return 0
+        ids = [row_id for row_id, _, _ in entries]
+        try:
+            in_graph = await get_existing_agent_ids([agent["elementId"] for _, _, agent in entries])
+        except Exception as e:
+            await self.chroma_db.run_in_executor(self.outbox.fail, ids, e)
+            raise
+
+        ready, pending, orphans = [], [], []
+        now = time.time()
+        for row_id, created_at, agent in entries:
+            if agent["elementId"] in in_graph:
+                ready.append((row_id, agent))
+            elif now - created_at < OUTBOX_ORPHAN_AGE:
+                pending.append(row_id)    # Graph write may still be in flight.
+            else:
+                orphans.append(row_id)
+
+        if ready:
+            try:
+                with STAGE_LATENCY.time(stage="index_batch"):
+                    await self.chroma_db.run_in_executor(
+                        self.chroma_db.store_agents, [agent for _, agent in ready]
+                    )
+                # Lets other workers pick the new agents up (see RegistrySync).
+                await stamp_indexed_agents([agent["elementId"] for _, agent in ready])
+            except Exception as e:
+                self.stats["failed_batches"] += 1
+                await self.chroma_db.run_in_executor(self.outbox.fail, [row_id for row_id, _ in ready], e)
+                raise
+            await self.chroma_db.run_in_executor(self.outbox.complete, [row_id for row_id, _ in ready])
+            self.stats["indexed"] += len(ready)
+        if pending:
+            await self.chroma_db.run_in_executor(self.outbox.defer, pending, INDEXER_POLL_INTERVAL)
+        if orphans:
+            logging.warning("Dropping %d outbox entries with no graph node", len(orphans))
+            await self.chroma_db.run_in_executor(self.outbox.complete, orphans)
+            self.stats["dropped"] += len(orphans)
+        return len(entries)
+
+    async def _reconcile_periodically(self):
+        while True:
+            await asyncio.sleep(RECONCILE_INTERVAL)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logging.error("Index reconciliation failed: %s", str(e), exc_info=True)
+
+    async def reconcile(self, dry_run=False, page_size=1000):
+        """
+        Compare the graph with the vector store: graph agents without a vector are
+        re-queued for indexing and vectors without a graph node are deleted.
+        Returns counts (and, for dry runs, the affected ids).
+        """
+        # Both passes hold one page at a time: missing agents are enqueued and orphan
+        # vectors deleted as each page is checked.
+        report = {"graph_agents": 0, "vectors": 0, "missing_vectors": 0, "orphan_vectors": 0, "dry_run": dry_run}
+        if dry_run:
+            report["missing_ids"], report["orphan_ids"] = [], []
+
+        after = None
+        while True:
+            agents = await get_agents_page(after, page_size)
+            if not agents:
+                break
+            report["graph_agents"] += len(agents)
+            after = agents[-1]["elementId"]
+            stored = await self.chroma_db.run_in_executor(
+                self.chroma_db.existing_ids, [agent["elementId"] for agent in agents]
+            )
+            missing = [agent for agent in agents if agent["elementId"] not in stored]
+            report["missing_vectors"] += len(missing)
+            if dry_run:
+                report["missing_ids"].extend(agent["elementId"] for agent in missing)
+            elif missing:
+                await self.chroma_db.run_in_executor(self.outbox.enqueue, missing)
+                self.notify()
+
+        offset = 0
+        while True:
+            ids = await self.chroma_db.run_in_executor(self.chroma_db.ids_page, offset, page_size)
+            if not ids:
+                break
+            report["vectors"] += len(ids)
+            in_graph = await get_existing_agent_ids(ids)
+            orphans = [element_id for element_id in ids if element_id not in in_graph]
+            report["orphan_vectors"] += len(orphans)
+            if dry_run:
+                report["orphan_ids"].extend(orphans)
+            elif orphans:
+                await self.chroma_db.run_in_executor(self.chroma_db.delete_agents, orphans)
+            # Deleted orphans no longer take up offsets.
+            offset += len(ids) - (0 if dry_run else len(orphans))
+
+        if not dry_run and report["orphan_vectors"]:
+            await bump_purged_version()
+        if not dry_run and (report["missing_vectors"] or report["orphan_vectors"]):
+            logging.info("Reconciliation re-queued %d agents and deleted %d orphan vectors",
+                         report["missing_vectors"], report["orphan_vectors"])
+        return report
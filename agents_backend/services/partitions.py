@@ -0,0 +1,116 @@
+"""
+Tree-scoped partitions (VECTOR_PARTITIONING=tree).
+
+Each agent is tagged with the root of the hierarchy it was created in: the SuperParent
+(or DummyAgent) at the top of its parent chain. Lookups for a parent only search that
+root's partition. Agents stored before partitioning was enabled have no tag; backfill
+them (from the agents_backend directory, server stopped) with:
+
+    python -m services.partitions backfill
+"""
+import argparse
+import asyncio
+import logging
+from collections import OrderedDict
+from db.neo4j_db import get_partition_roots, set_agent_partitions, close_driver
+from config import VECTOR_PARTITIONING, PARTITION_ROOT_CACHE_SIZE
+
+class PartitionResolver:
+    """
+    Maps parent ids to partition roots through the graph, with an LRU cache. Ids
+    unknown to the graph are their own root (they become a DummyAgent on registration).
+    """
+    def __init__(self, max_size=PARTITION_ROOT_CACHE_SIZE):
+        self.max_size = max_size
+        self._roots = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def __len__(self):
+        return len(self._roots)
+
+    @property
+    def enabled(self):
+        return VECTOR_PARTITIONING == "tree"
+
+    async def resolve(self, node_ids):
+        """Returns the partition root of each id (None for each when partitioning is off)."""
+        if not self.enabled:
+            return [None] * len(node_ids)
+        missing = []
+        for node_id in node_ids:
+            if node_id in self._roots:
+                self._roots.move_to_end(node_id)
+                self.stats["hits"] += 1
+            else:
+                missing.append(node_id)
+                self.stats["misses"] += 1
+        if missing:
+            found = await get_partition_roots(set(missing))
+            for node_id in missing:
+                self.remember(node_id, found.get(node_id, node_id))
+        return [self._roots.get(node_id, node_id) for node_id in node_ids]
+
+    def remember(self, node_id, root):
+        self._roots[node_id] = root
+        self._roots.move_to_end(node_id)
+        while len(self._roots) > self.max_size:
+            self._roots.popitem(last=False)
+
+    def clear(self):
+        # Edges may have been rewired (compaction, resets).
+        self._roots.clear()
+
+
+async def backfill_partitions(chroma_db, batch_size=1000):
+    """
+    Tags stored agents that have no partition with their root, in ChromaDB and on the
+    Agent nodes. Returns the number of agents tagged.
+    """
+    tagged = offset = 0
+    while True:
+        page = await chroma_db.run_in_executor(
+            chroma_db.agents_collection.get, include=["metadatas"], limit=batch_size, offset=offset
+        )
+        if not page["ids"]:
+            break
+        offset += len(page["ids"])
+        untagged = [
+            element_id for element_id, metadata in zip(page["ids"], page["metadatas"])
+            if not (metadata or {}).get("partition")
+        ]
+        if not untagged:
+            continue
+        roots = await get_partition_roots(untagged)
+        rows = [{"elementId": element_id, "partition": roots[element_id]} for element_id in untagged if element_id in roots]
+        if not rows:
+            continue
+        await set_agent_partitions(rows)
+        await chroma_db.run_in_executor(
+            chroma_db.agents_collection.update,
+            ids=[row["elementId"] for row in rows],
+            metadatas=[{"partition": row["partition"]} for row in rows]
+        )
+        tagged += len(rows)
+    chroma_db.reload_vector_index()
+    chroma_db.lookup_cache.clear()
+    logging.info("Tagged %d agents with their partition", tagged)
+    return tagged
+
+
+async def _main(args):
+    from db.chroma_db import ChromaDBManager
+    chroma_db = ChromaDBManager()
+    try:
+        print(f"Tagged {await backfill_partitions(chroma_db, args.batch_size)} agents")
+    finally:
+        chroma_db.close()
+        await close_driver()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("backfill",))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args))
@@ -0,0 +1,180 @@
+"""
+Streaming export/import of the agent registry as NDJSON.
+
+One JSON record per line, read from the stores in fixed-size pages so memory
+stays constant whatever the registry size:
+
+    {"type": "header", "version": 1, "embeddings": true}
+    {"type": "super_parent", "id": ..., "created_at": ...}
+    {"type": "dummy_agent", "agent_id": ..., "problem_statement": ...}
+    {"type": "agent", "agent": {elementId, role, ...}, "embedding": [...]}
+    {"type": "edge", "from": ..., "from_kind": "Agent|SuperParent|DummyAgent", "to": <elementId>}
+
+Each page of agents is followed by the DEPENDS_ON edges into those agents.
+Import loads batches with UNWIND writes and batched ChromaDB upserts, reusing
+exported embeddings. Run from the agents_backend directory, with the server
+stopped (or use the /admin/export and /admin/import endpoints instead):
+
+    python -m services.registry_io export registry.ndjson --embeddings
+    python -m services.registry_io import registry.ndjson
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from db.neo4j_db import (
+    get_agents_page,
+    get_parent_nodes_page,
+    get_incoming_edges,
+    import_rows,
+    stamp_indexed_agents,
+    close_driver
+)
+
+FORMAT_VERSION = 1
+RECORD_TYPES = ("super_parent", "dummy_agent", "agent", "edge")
+
+async def export_registry(chroma_db, include_embeddings=False, batch_size=1000):
+    """Async generator of export records (dicts), in the order described above."""
+    yield {"type": "header", "version": FORMAT_VERSION, "embeddings": include_embeddings}
+
+    for label, record_type, key in (("SuperParent", "super_parent", "id"), ("DummyAgent", "dummy_agent", "agent_id")):
+        after = None
+        while True:
+            nodes = await get_parent_nodes_page(label, after, batch_size)
+            if not nodes:
+                break
+            after = nodes[-1][key]
+            for node in nodes:
+                yield {"type": record_type, **node}
+
+    after = None
+    while True:
+        agents = await get_agents_page(after, batch_size)
+        if not agents:
+            break
+        after = agents[-1]["elementId"]
+        ids = [agent["elementId"] for agent in agents]
+        embeddings = (
+            await chroma_db.run_in_executor(chroma_db.get_embeddings, ids) if include_embeddings else {}
+        )
+        for agent in agents:
+            agent.pop("indexed_version", None)    # Worker sync bookkeeping, reassigned on import.
+            record = {"type": "agent", "agent": agent}
+            if agent["elementId"] in embeddings:
+                record["embedding"] = embeddings[agent["elementId"]]
+            yield record
+        for edge in await get_incoming_edges(ids):
+            yield {"type": "edge", **edge}
+
+
+async def import_registry(chroma_db, lines, batch_size=1000):
+    """
+    Load an export from `lines` (an async iterable of NDJSON lines). Records are
+    buffered per type and written a batch at a time; the graph write and the
+    ChromaDB upsert of an agent batch run concurrently. Returns counts per type.
+    """
+    buffers = {record_type: [] for record_type in RECORD_TYPES}
+    embeddings = []
+    counts = dict.fromkeys(RECORD_TYPES, 0)
+
+    async def flush(record_type):
+        rows = buffers[record_type]
+        if not rows:
+            return
+        if record_type == "agent":
+            await asyncio.gather(import_rows("agent", rows), _index_agents(chroma_db, rows, embeddings))
+            await stamp_indexed_agents([agent["elementId"] for agent in rows])
+            embeddings.clear()
+        else:
+            await import_rows(record_type, rows)
+        counts[record_type] += len(rows)
+        buffers[record_type] = []
+
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            record_type = record.pop("type")
+        except (ValueError, KeyError, AttributeError):
+            raise ValueError(f"Invalid record on line {line_number}")
+        if record_type == "header":
+            if record.get("version") != FORMAT_VERSION:
+                raise ValueError(f"Unsupported export version: {record.get('version')}")
+            continue
+        if record_type not in buffers:
+            raise ValueError(f"Unknown record type {record_type!r} on line {line_number}")
+
+        if record_type == "agent":
+            buffers["agent"].append(record["agent"])
+            embeddings.append(record.get("embedding"))
+        else:
+            buffers[record_type].append(record)
+        if len(buffers[record_type]) >= batch_size:
+            await flush(record_type)
+
+    for record_type in RECORD_TYPES:
+        await flush(record_type)
+    return counts
+
+
+async def _index_agents(chroma_db, agents, embeddings):
+    # Exported embeddings are reused; agents exported without one are embedded in one batch.
+    with_vectors = [(agent, vector) for agent, vector in zip(agents, embeddings) if vector is not None]
+    without = [agent for agent, vector in zip(agents, embeddings) if vector is None]
+    if with_vectors:
+        await chroma_db.run_in_executor(
+            chroma_db.store_agents, [agent for agent, _ in with_vectors], [vector for _, vector in with_vectors]
+        )
+    if without:
+        await chroma_db.run_in_executor(chroma_db.store_agents, without)
+
+
+async def _read_lines(stream):
+    # Blocking reads are fine for the CLI: nothing else runs on its event loop.
+    for line in stream:
+        yield line
+
+
+async def _main(args):
+    from db.chroma_db import ChromaDBManager
+    chroma_db = ChromaDBManager()
+    try:
+        if args.command == "export":
+            out = open(args.path, "w") if args.path != "-" else sys.stdout
+            try:
+                exported = 0
+                async for record in export_registry(chroma_db, args.embeddings, args.batch_size):
+                    out.write(json.dumps(record) + "\n")
+                    exported += 1
+                logging.info("Exported %d records", exported)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+        else:
+            source = open(args.path) if args.path != "-" else sys.stdin
+            try:
+                counts = await import_registry(chroma_db, _read_lines(source), args.batch_size)
+                logging.info("Imported %s", counts)
+            finally:
+                if source is not sys.stdin:
+                    source.close()
+    finally:
+        chroma_db.close()
+        await close_driver()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("path", help="NDJSON file, or - for stdout/stdin")
+    parser.add_argument("--embeddings", action="store_true", help="include stored embeddings in the export")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args))
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from db.neo4j_db import get_registry_version, get_agents_indexed_between
+from config import REGISTRY_SYNC_INTERVAL
+
+class RegistrySync:
+    """
+    Keeps this worker's in-process state (lookup cache, vector index mirror, bootstrap
+    flag) consistent with writes made by other workers and replicas, using the
+    registry version stamp in Neo4j. Agents indexed since the last check are added
+    to the caches; a purge (agents deleted, registry reset) drops the lookup cache
+    and reloads the mirror from ChromaDB.
+    """
+    def __init__(self, chroma_db, on_purge=None, page_size=1000):
+        self.chroma_db = chroma_db
+        self.on_purge = on_purge
+        self.page_size = page_size
+        self.version = None
+        self._task = None
+        self.stats = {"checks": 0, "refreshed_agents": 0, "purges": 0}
+
+    def start(self):
+        if self._task is None and REGISTRY_SYNC_INTERVAL > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def prime(self):
+        # Called before the vector index is loaded, so nothing indexed after the
+        # load can be missed (agents stamped in between are just added twice).
+        self.version, _ = await get_registry_version()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(REGISTRY_SYNC_INTERVAL)
+            try:
+                await self.check()
+            except Exception as e:
+                logging.error("Registry sync failed: %s", str(e), exc_info=True)
+
+    async def check(self):
+        """Bring local state up to the current registry version; returns that version."""
+        if self.version is None:
+            await self.prime()
+            return self.version
+        self.stats["checks"] += 1
+        version, purged_version = await get_registry_version()
+        if version <= self.version:
+            return self.version
+
+        if purged_version > self.version:
+            self.chroma_db.lookup_cache.clear()
+            await self.chroma_db.run_in_executor(self.chroma_db.reload_vector_index)
+            if self.on_purge is not None:
+                self.on_purge()
+            self.stats["purges"] += 1
+            logging.info("Registry purged at version %d; caches reloaded", purged_version)
+            # Agents indexed after the purge are still applied below.
+            since = purged_version
+        else:
+            since = self.version
+
+        after = None
+        while True:
+            rows = await get_agents_indexed_between(since, version, after, self.page_size)
+            if not rows:
+                break
+            agents = [agent for agent, _ in rows]
+            await self.chroma_db.run_in_executor(self.chroma_db.refresh_agents, agents)
+            self.stats["refreshed_agents"] += len(agents)
+            after = (rows[-1][1], agents[-1]["elementId"])
+            if len(rows) < self.page_size:
+                break
+        self.version = version
+        return version
@@ -0,0 +1,172 @@
+# testing_files/bench_neo4j_scaling.py
+"""
+Measures how agent lookup and registration scale with registry size.
+
+Seeds the configured Neo4j instance with 1k -> 1M benchmark Agent nodes (tagged
+with `bench: true`) and, at each size, times the calls the service makes:
+get_agents_by_ids (match hydration), register_agent mapping an existing agent to
+a parent (a registry hit) and register_agent with a new agent (a miss). Prints
+the results as JSON. Run it from the
+agents_backend directory:
+
+    python testing_files/bench_neo4j_scaling.py --sizes 1000 10000 100000 1000000
+
+Pass --no-schema to measure the label-scan baseline without constraints.
+Benchmark nodes are removed at the end unless --keep is given.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.neo4j_db import (  # noqa: E402
+    SCHEMA_STATEMENTS,
+    close_driver,
+    ensure_schema,
+    get_agents_by_ids,
+    get_driver,
+    register_agent,
+)
+
+SEED_BATCH_SIZE = 10_000
+SAMPLES_PER_BATCH = 200
+
+
+async def drop_schema():
+    async with get_driver().session() as session:
+        for statement in SCHEMA_STATEMENTS:
+            # "CREATE CONSTRAINT <name> ..." or "CREATE INDEX <name> ...".
+            _, kind, name = statement.split()[:3]
+            result = await session.run(f"DROP {kind} {name} IF EXISTS")
+            await result.consume()
+
+
+async def seed_agents(count, sample_ids):
+    # Create `count` benchmark agents in UNWIND batches, keeping a sample of ids for lookups.
+    async def _seed(tx, ids):
+        result = await tx.run(
+            """
+            UNWIND $ids AS id
+            CREATE (:Agent {
+                elementId: id,
+                role: 'Benchmark Agent',
+                role_description: 'Synthetic agent used by bench_neo4j_scaling.py',
+                task_prompt: 'Nothing to do',
+                bench: true
+            })
+            """,
+            ids=ids
+        )
+        await result.consume()
+
+    async with get_driver().session() as session:
+        remaining = count
+        while remaining > 0:
+            ids = [str(uuid.uuid4()) for _ in range(min(SEED_BATCH_SIZE, remaining))]
+            await session.execute_write(_seed, ids)
+            sample_ids.extend(ids[:SAMPLES_PER_BATCH])
+            remaining -= len(ids)
+
+
+async def create_bench_parents(count):
+    parent_ids = [f"bench_parent_{uuid.uuid4()}" for _ in range(count)]
+    async with get_driver().session() as session:
+        await session.execute_write(
+            lambda tx: tx.run(
+                "UNWIND $ids AS id CREATE (:DummyAgent {agent_id: id, bench: true})",
+                ids=parent_ids
+            )
+        )
+    return parent_ids
+
+
+async def cleanup():
+    async with get_driver().session() as session:
+        result = await session.run(
+            """
+            MATCH (n) WHERE n.bench = true
+            CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS
+            """
+        )
+        await result.consume()
+
+
+async def time_calls(calls):
+    timings = []
+    for call in calls:
+        start = time.perf_counter()
+        await call()
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarize(timings)
+
+
+def summarize(timings_ms):
+    quantiles = statistics.quantiles(timings_ms, n=100) if len(timings_ms) > 1 else timings_ms * 99
+    return {
+        "samples": len(timings_ms),
+        "p50_ms": round(quantiles[49], 3),
+        "p99_ms": round(quantiles[98], 3),
+        "mean_ms": round(statistics.fmean(timings_ms), 3),
+    }
+
+
+async def run_benchmark(sizes, samples, use_schema, keep):
+    if use_schema:
+        await ensure_schema()
+    else:
+        await drop_schema()
+
+    results = []
+    seeded = 0
+    sample_ids = []
+    try:
+        for size in sorted(sizes):
+            await seed_agents(size - seeded, sample_ids)
+            seeded = size
+            lookup_ids = sample_ids[-samples:]
+            parents = await create_bench_parents(len(lookup_ids))
+
+            lookup = await time_calls(
+                [lambda element_id=element_id: get_agents_by_ids([element_id]) for element_id in lookup_ids]
+            )
+            # An existing agent is only merged (ON CREATE SET), so this times the parent and edge writes.
+            map_existing = await time_calls(
+                [lambda p=p, c=c: register_agent(p, "benchmark", {"elementId": c}) for p, c in zip(parents, lookup_ids)]
+            )
+            register = await time_calls(
+                [lambda p=p: register_agent(p, "benchmark", {
+                    "elementId": str(uuid.uuid4()), "role": "Benchmark Agent", "bench": True
+                }) for p in parents]
+            )
+            seeded += len(parents)
+            results.append({
+                "agents": size,
+                "schema": use_schema,
+                "get_agents_by_ids": lookup,
+                "register_agent_existing": map_existing,
+                "register_agent_new": register,
+            })
+            print(f"Finished {size} agents", file=sys.stderr)
+    finally:
+        if not keep:
+            await cleanup()
+        await close_driver()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--no-schema", action="store_true", help="drop the registry constraints first")
+    parser.add_argument("--keep", action="store_true", help="keep benchmark nodes afterwards")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args.sizes, args.samples, not args.no_schema, args.keep))
+    print(json.dumps(report, indent=2))
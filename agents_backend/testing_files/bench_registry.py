@@ -0,0 +1,425 @@
+# testing_files/bench_registry.py
+"""
+Load test for the registry pipeline with local stand-ins for its dependencies.
+
+Starts a fake Ollama HTTP server (configurable latency, answers /api/chat with a
+valid agent, streamed or not), points ChromaDB and the embedding cache at a
+temporary directory and replaces the Neo4j calls used by AgentService with an
+in-memory graph (configurable latency). It then seeds the registry and drives
+the workload at a given concurrency and hit/miss mix, both through the FastAPI
+app (POST /submit_problem/, in-process ASGI) and directly through
+AgentService.process_problem. Throughput and p50/p95/p99 for end-to-end latency
+and every pipeline stage are printed as JSON. Run it from the agents_backend
+directory:
+
+    python testing_files/bench_registry.py --requests 500 --concurrency 16 --hit-ratio 0.7
+
+--fake-embeddings swaps the ONNX embedding model for a hashing embedding so the
+benchmark measures the service itself (and runs without the model download).
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = ("service", "http")
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    # Answers /api/chat like Ollama, after `server.latency` seconds (plus jitter).
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        statement = body.get("messages", [{}])[-1].get("content", "")
+        content = json.dumps({
+            "role": f"Agent {hashlib.sha1(statement.encode()).hexdigest()[:8]}",
+            "role_description": f"Handles: {statement}",
+            "task_prompt": f"Solve the following problem step by step: {statement}"
+        })
+        time.sleep(max(0.0, random.gauss(self.server.latency, self.server.jitter)))
+
+        if body.get("stream", True):
+            chunks = [content[i:i + 16] for i in range(0, len(content), 16)]
+            lines = [self._message(chunk, False) for chunk in chunks] + [self._message("", True)]
+            payload = b"".join(json.dumps(line).encode() + b"\n" for line in lines)
+            content_type = "application/x-ndjson"
+        else:
+            payload = json.dumps(self._message(content, True)).encode()
+            content_type = "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _message(self, content, done):
+        return {
+            "model": "llama3.2",
+            "created_at": "2024-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": content},
+            "done": done
+        }
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_ollama(latency, jitter):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeGraph:
+    """In-memory replacement for the db.neo4j_db calls made by AgentService and the indexer."""
+    def __init__(self, latency):
+        self.latency = latency
+        self.agents = {}
+        self.edges = set()
+        self.super_parents = set()
+        self.version = 0
+        self.purged_version = 0
+        self.indexed_versions = {}
+
+    async def _round_trip(self):
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.latency / 4)))
+
+    async def check_agents_exist(self):
+        await self._round_trip()
+        return bool(self.agents)
+
+    async def create_super_parent_node(self):
+        await self._round_trip()
+        parent_id = str(uuid.uuid4())
+        self.super_parents.add(parent_id)
+        return parent_id
+
+    def _write(self, row):
+        parent_id = row["parent_id"]
+        parent_created = not parent_id
+        if parent_created:
+            parent_id = str(uuid.uuid4())
+            self.super_parents.add(parent_id)
+        agent = row["agent"]
+        self.agents.setdefault(agent["elementId"], agent)
+        self.edges.add((parent_id, agent["elementId"]))
+        return {"parent_id": parent_id, "parent_created": parent_created, "elementId": agent["elementId"]}
+
+    async def register_agent(self, parent_id, problem_statement, agent_data):
+        await self._round_trip()
+        return self._write({"parent_id": parent_id, "problem_statement": problem_statement, "agent": agent_data})
+
+    async def register_agents_batch(self, rows):
+        await self._round_trip()
+        return [self._write(row) for row in rows]
+
+    async def get_existing_agent_ids(self, element_ids):
+        await self._round_trip()
+        return {element_id for element_id in element_ids if element_id in self.agents}
+
+    async def get_agents_by_ids(self, element_ids):
+        await self._round_trip()
+        return {element_id: self.agents[element_id] for element_id in element_ids if element_id in self.agents}
+
+    async def get_partition_roots(self, node_ids):
+        await self._round_trip()
+        parents = {child: parent for parent, child in self.edges}
+        roots = {}
+        for node_id in node_ids:
+            root = node_id
+            while root in parents and not self.agents.get(root, {}).get("partition"):
+                root = parents[root]
+            roots[node_id] = self.agents.get(root, {}).get("partition") or root
+        return roots
+
+    async def get_agents_page(self, after=None, limit=1000):
+        await self._round_trip()
+        ids = sorted(element_id for element_id in self.agents if element_id > (after or ""))
+        return [self.agents[element_id] for element_id in ids[:limit]]
+
+    async def register_decomposition(self, rows, dependencies):
+        await self._round_trip()
+        self.edges.update((dependency["from"], dependency["to"]) for dependency in dependencies)
+        return [self._write(row) for row in rows]
+
+    async def stamp_indexed_agents(self, element_ids):
+        await self._round_trip()
+        self.version += 1
+        for element_id in element_ids:
+            if element_id in self.agents:
+                self.indexed_versions[element_id] = self.version
+        return self.version
+
+    async def bump_purged_version(self):
+        await self._round_trip()
+        self.version += 1
+        self.purged_version = self.version
+        return self.version
+
+    async def get_registry_version(self):
+        await self._round_trip()
+        return self.version, self.purged_version
+
+    async def get_agents_indexed_between(self, since, until, after=None, limit=1000):
+        await self._round_trip()
+        after = after or (since, "")
+        rows = sorted(
+            (version, element_id) for element_id, version in self.indexed_versions.items()
+            if since < version <= until and (version, element_id) > after
+        )
+        return [(self.agents[element_id], version) for version, element_id in rows[:limit]]
+
+
+def hashing_embedding_function():
+    from chromadb.api.types import EmbeddingFunction
+    import numpy as np
+
+    class HashingEmbeddingFunction(EmbeddingFunction):
+        # Deterministic random unit vector per text: repeats match exactly, distinct texts don't match.
+        def __init__(self):
+            pass
+
+        def __call__(self, input):
+            vectors = []
+            for text in input:
+                seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+                vector = np.random.default_rng(seed).standard_normal(384).astype(np.float32)
+                vectors.append(vector / np.linalg.norm(vector))
+            return vectors
+
+        @staticmethod
+        def name():
+            return "bench-hashing"
+
+        def get_config(self):
+            return {}
+
+        @staticmethod
+        def build_from_config(config):
+            return HashingEmbeddingFunction()
+
+    return HashingEmbeddingFunction()
+
+
+def record_stage_samples(histogram):
+    # Keep raw observations next to the histogram buckets so percentiles are exact.
+    samples = defaultdict(list)
+    observe = histogram.observe
+
+    def recording_observe(value, **labels):
+        samples[labels.get("stage", "")].append(value)
+        observe(value, **labels)
+
+    histogram.observe = recording_observe
+    return samples
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    if len(values) == 1:
+        p50 = p95 = p99 = values[0]
+    else:
+        quantiles = statistics.quantiles(values, n=100, method="inclusive")
+        p50, p95, p99 = quantiles[49], quantiles[94], quantiles[98]
+    return {
+        "count": len(values),
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "p99_ms": round(p99 * 1000, 3)
+    }
+
+
+def build_workload(rng, seeded, count, hit_ratio, tag):
+    # Hits repeat a seeded statement, misses are statements the registry has not seen.
+    workload = []
+    for i in range(count):
+        if seeded and rng.random() < hit_ratio:
+            workload.append(("hit", rng.choice(seeded)))
+        else:
+            workload.append(("miss", f"Benchmark problem {tag}-{i}: {uuid.uuid4().hex}"))
+    return workload
+
+
+async def drive(workload, concurrency, submit):
+    # Runs `submit(statement)` over the workload with at most `concurrency` requests in flight.
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    queue = asyncio.Queue()
+    for item in workload:
+        queue.put_nowait(item)
+
+    async def worker():
+        while not queue.empty():
+            kind, statement = queue.get_nowait()
+            start = time.perf_counter()
+            error = await submit(statement)
+            if error:
+                errors[error] += 1
+            else:
+                latencies[kind].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    completed = sum(len(values) for values in latencies.values())
+    return {
+        "requests": len(workload),
+        "completed": completed,
+        "errors": dict(errors),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(completed / elapsed, 2) if elapsed else 0.0,
+        "latency": {
+            "all": percentiles([value for values in latencies.values() for value in values]),
+            **{kind: percentiles(values) for kind, values in latencies.items()}
+        }
+    }
+
+
+async def run(args):
+    import httpx
+    import main
+    from metrics import MATCHES, STAGE_LATENCY
+    from services import agent_service as agent_service_module
+    from services import indexer as indexer_module
+    from services import registry_sync as registry_sync_module
+    from services import partitions as partitions_module
+    from services.agent_service import AgentService
+    from db.chroma_db import ChromaDBManager
+
+    graph = FakeGraph(args.neo4j_latency)
+    for name in ("check_agents_exist", "create_super_parent_node", "register_agent",
+                 "register_agents_batch", "register_decomposition", "stamp_indexed_agents", "bump_purged_version", "get_agents_by_ids"):
+        setattr(agent_service_module, name, getattr(graph, name))
+    for name in ("get_existing_agent_ids", "get_agents_page", "stamp_indexed_agents", "bump_purged_version"):
+        setattr(indexer_module, name, getattr(graph, name))
+    for name in ("get_registry_version", "get_agents_indexed_between"):
+        setattr(registry_sync_module, name, getattr(graph, name))
+    partitions_module.get_partition_roots = graph.get_partition_roots
+
+    chroma_db = ChromaDBManager(hashing_embedding_function() if args.fake_embeddings else None)
+    chroma_db.load_vector_index()
+    chroma_db.load_embedding_model()
+    service = AgentService(chroma_db=chroma_db)
+    service.start()
+    main.agent_service = service
+    stage_samples = record_stage_samples(STAGE_LATENCY)
+    rng = random.Random(args.seed)
+
+    # Seed the registry with one super parent and `--seed-agents` agents.
+    root = await service.process_problem(None, "Benchmark root problem")
+    parent_id = root["agent"]["elementId"]
+    seeded = [f"Seeded benchmark problem {i}: {uuid.uuid4().hex}" for i in range(args.seed_agents)]
+    for start in range(0, len(seeded), 100):
+        await service.process_problems([(parent_id, statement) for statement in seeded[start:start + 100]])
+
+    async def submit_service(statement):
+        try:
+            await service.process_problem(parent_id, statement)
+        except Exception as e:
+            return type(e).__name__
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def submit_http(statement):
+            response = await client.post(
+                "/submit_problem/", json={"parent_id": parent_id, "problem_statement": statement}
+            )
+            return None if response.status_code == 200 else f"HTTP {response.status_code}"
+
+        reports = []
+        for mode in args.modes:
+            stage_samples.clear()
+            matches_before = MATCHES.snapshot()
+            workload = build_workload(rng, seeded, args.requests, args.hit_ratio, mode)
+            report = await drive(workload, args.concurrency, submit_http if mode == "http" else submit_service)
+            report = {
+                "mode": mode,
+                "concurrency": args.concurrency,
+                "hit_ratio": args.hit_ratio,
+                **report,
+                "matches": {
+                    key[0]: value - matches_before.get(key, 0) for key, value in MATCHES.snapshot().items()
+                },
+                "stages": {stage: percentiles(values) for stage, values in sorted(stage_samples.items())}
+            }
+            reports.append(report)
+            print(f"Finished {mode}: {report['throughput_rps']} req/s", file=sys.stderr)
+
+    await service.close()
+    return {
+        "config": {
+            "seed_agents": args.seed_agents,
+            "ollama_latency_s": args.ollama_latency,
+            "neo4j_latency_s": args.neo4j_latency,
+            "fake_embeddings": args.fake_embeddings,
+            "generation_max_concurrency": service.agent_creator.scheduler.max_concurrency,
+            "vector_index_mode": os.environ.get("VECTOR_INDEX_MODE", "off")
+        },
+        "runs": reports
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--hit-ratio", type=float, default=0.7)
+    parser.add_argument("--seed-agents", type=int, default=500)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--ollama-latency", type=float, default=0.5, help="seconds per fake generation")
+    parser.add_argument("--ollama-jitter", type=float, default=0.05)
+    parser.add_argument("--neo4j-latency", type=float, default=0.002, help="seconds per fake graph round trip")
+    parser.add_argument("--generation-concurrency", type=int, help="overrides GENERATION_MAX_CONCURRENCY")
+    parser.add_argument("--fake-embeddings", action="store_true")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    ollama_server = start_fake_ollama(args.ollama_latency, args.ollama_jitter)
+    workdir = tempfile.mkdtemp(prefix="bench_registry_")
+
+    # Configuration is read at import time, so it is set before the app is imported.
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{ollama_server.server_port}"
+    os.environ["CHROMA_PATH"] = os.path.join(workdir, "chroma_db")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding_cache.sqlite3")
+    os.environ["OUTBOX_PATH"] = os.path.join(workdir, "index_outbox.sqlite3")
+    os.environ["NEO4J_SCHEMA_BOOTSTRAP"] = "false"
+    os.environ.setdefault("NEO4J_URI", "bolt://localhost:7687")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if args.generation_concurrency:
+        os.environ["GENERATION_MAX_CONCURRENCY"] = str(args.generation_concurrency)
+    os.environ.setdefault("GENERATION_MAX_QUEUE", str(max(args.concurrency, 16)))
+
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        ollama_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,114 @@
+# testing_files/bench_vector_index.py
+"""
+Compares top-1 agent matching through Chroma with the in-memory vector index.
+
+Builds a throwaway Chroma collection filled with random unit vectors (the same
+dimension as the default embedding model), mirrors it into the flat and HNSW
+indexes from db/vector_index.py, and reports per-query latency and how often
+each index agrees with Chroma on the match decision (nearest id under the
+0.85 distance threshold). Run it from the agents_backend directory:
+
+    python testing_files/bench_vector_index.py --sizes 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.chroma_db import SIMILARITY_THRESHOLD  # noqa: E402
+from db.vector_index import FlatVectorIndex, HnswVectorIndex, hnswlib, load_index_from_collection  # noqa: E402
+
+DIMENSION = 384
+
+
+def random_unit_vectors(rng, count):
+    vectors = rng.standard_normal((count, DIMENSION)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def near_queries(rng, vectors, count):
+    # Half the queries sit close to a stored agent (matches), half are random (misses).
+    picks = vectors[rng.integers(0, len(vectors), count // 2)]
+    close = picks + 0.02 * rng.standard_normal(picks.shape).astype(np.float32)
+    close /= np.linalg.norm(close, axis=1, keepdims=True)
+    return np.vstack([close, random_unit_vectors(rng, count - len(close))])
+
+
+def decision(hit):
+    # The match decision process_problem makes: nearest id, or None above the threshold.
+    element_id, distance = hit
+    return element_id if distance <= SIMILARITY_THRESHOLD else None
+
+
+def time_queries(search, queries):
+    timings, decisions = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hit = search(query)
+        timings.append((time.perf_counter() - start) * 1000)
+        decisions.append(decision(hit))
+    quantiles = statistics.quantiles(timings, n=100)
+    return {"p50_ms": round(quantiles[49], 4), "p99_ms": round(quantiles[98], 4)}, decisions
+
+
+def bench_size(size, query_count, rng):
+    path = tempfile.mkdtemp(prefix="bench_chroma_")
+    try:
+        client = chromadb.PersistentClient(path=path)
+        collection = client.get_or_create_collection("agents")
+        vectors = random_unit_vectors(rng, size)
+        ids = [f"agent-{i}" for i in range(size)]
+        batch = client.get_max_batch_size()
+        for start in range(0, size, batch):
+            collection.add(
+                ids=ids[start:start + batch],
+                embeddings=vectors[start:start + batch],
+                metadatas=[{"role": "Benchmark Agent"}] * len(ids[start:start + batch])
+            )
+
+        queries = near_queries(rng, vectors, query_count)
+
+        def chroma_search(query):
+            result = collection.query(query_embeddings=[query], n_results=1)
+            return result["ids"][0][0], result["distances"][0][0]
+
+        report = {"agents": size}
+        report["chroma"], reference = time_queries(chroma_search, queries)
+
+        indexes = {"flat": FlatVectorIndex(capacity=size)}
+        if hnswlib is not None:
+            indexes["hnsw"] = HnswVectorIndex(capacity=size)
+        for name, index in indexes.items():
+            start = time.perf_counter()
+            load_index_from_collection(index, collection)
+            load_seconds = time.perf_counter() - start
+            latency, decisions = time_queries(lambda query: index.search([query], 1)[0][0], queries)
+            agreement = sum(a == b for a, b in zip(reference, decisions)) / len(queries)
+            report[name] = dict(latency, warm_load_s=round(load_seconds, 2), agreement_with_chroma=agreement)
+        return report
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for size in args.sizes:
+        results.append(bench_size(size, args.queries, rng))
+        print(f"Finished {size} agents", file=sys.stderr)
+    print(json.dumps(results, indent=2))
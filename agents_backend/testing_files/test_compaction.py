@@ -0,0 +1,87 @@
+# testing_files/test_compaction.py
+# Run from the agents_backend directory: python -m pytest testing_files/test_compaction.py
+import asyncio
+import os
+import sys
+import uuid
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import compaction
+
+
+@pytest.fixture
+def chroma_db(tmp_path, monkeypatch):
+    from db import chroma_db as chroma_db_module
+    # config is read at import time, so the module's copy is patched; no cache file is written.
+    monkeypatch.setattr(chroma_db_module, "EMBEDDING_CACHE_ENABLED", False)
+    manager = chroma_db_module.ChromaDBManager(embedding_function=None, path=str(tmp_path / "chroma_db"))
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    # Stands in for the Neo4j calls: every vector has a node, merges are recorded.
+    merged = []
+
+    async def get_existing_agent_ids(element_ids):
+        return set(element_ids)
+
+    async def merge_duplicate_agents(pairs):
+        merged.extend(pairs)
+        return {"merged": len(pairs), "rewired_edges": 0}
+
+    async def bump_purged_version():
+        return 1
+
+    monkeypatch.setattr(compaction, "get_existing_agent_ids", get_existing_agent_ids)
+    monkeypatch.setattr(compaction, "merge_duplicate_agents", merge_duplicate_agents)
+    monkeypatch.setattr(compaction, "bump_purged_version", bump_purged_version)
+    return merged
+
+
+def _store(chroma_db, partitions, vector):
+    agents = [
+        {"elementId": str(uuid.uuid4()), "role": "Sorter", "role_description": "Sorts", "task_prompt": "Sort",
+         "problem_statement": "sort a list", "creation_timestamp": index}
+        for index in range(len(partitions))
+    ]
+    chroma_db.store_agents(agents, [vector] * len(agents))
+    chroma_db.agents_collection.update(
+        ids=[agent["elementId"] for agent in agents],
+        metadatas=[{"partition": partition} for partition in partitions]
+    )
+    return [agent["elementId"] for agent in agents]
+
+
+def test_identical_agents_in_different_partitions_are_not_merged(chroma_db, graph):
+    vector = np.ones(8, dtype=np.float32).tolist()
+    _store(chroma_db, ["tree-a", "tree-b"], vector)
+
+    report = asyncio.run(compaction.compact_registry(chroma_db, dry_run=False, by_partition=True))
+
+    assert report["merged"] == 0
+    assert graph == []
+    assert chroma_db.agents_collection.count() == 2
+
+
+def test_identical_agents_in_one_partition_are_merged(chroma_db, graph):
+    vector = np.ones(8, dtype=np.float32).tolist()
+    oldest, duplicate, other_tree = _store(chroma_db, ["tree-a", "tree-a", "tree-b"], vector)
+
+    report = asyncio.run(compaction.compact_registry(chroma_db, dry_run=False, by_partition=True))
+
+    assert report["merged"] == 1
+    assert graph == [{"duplicate": duplicate, "canonical": oldest}]
+    assert set(chroma_db.agents_collection.get()["ids"]) == {oldest, other_tree}
+
+
+def test_chained_cluster_only_merges_within_threshold():
+    # a~b and b~c, but c is too far from a: c must not be folded into a.
+    vectors = np.array([[0.0], [0.3], [0.6]], dtype=np.float32)
+    clusters = compaction.find_duplicate_clusters(vectors, threshold=0.1)
+    assert [sorted(cluster) for cluster in clusters] == [[0, 1, 2]]
+    assert compaction.plan_merges([0, 1, 2], vectors, threshold=0.1) == [(0, [1])]
@@ -0,0 +1,89 @@
+# testing_files/test_generation_scheduler.py
+# Run from the agents_backend directory: python -m pytest testing_files/test_generation_scheduler.py
+import asyncio
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.agent_creation import GenerationScheduler
+from agents.errors import GenerationQueueFull
+
+
+def test_calls_beyond_the_queue_are_rejected():
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1, max_queue=2, timeout=5)
+        release = asyncio.Event()
+
+        async def generate(value):
+            await release.wait()
+            return value
+
+        tasks = [asyncio.create_task(scheduler.run(generate, value)) for value in range(3)]
+        await asyncio.sleep(0.01)     # Lets the first call take the slot.
+        assert (scheduler.active, scheduler.waiting) == (1, 2)
+        assert scheduler.is_full()
+        with pytest.raises(GenerationQueueFull) as error:
+            await scheduler.run(generate, 3)
+        assert error.value.retry_after >= 1
+
+        release.set()
+        assert await asyncio.gather(*tasks) == [0, 1, 2]
+        assert (scheduler.active, scheduler.waiting) == (0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_timeout_covers_the_queue_wait():
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1, max_queue=1, timeout=0.05)
+
+        async def fast():
+            return "done"
+
+        # Hold the only slot directly, so the call can time out while still queued.
+        await scheduler._slots.acquire()
+        with pytest.raises(asyncio.TimeoutError):
+            await scheduler.run(fast)
+        assert (scheduler.active, scheduler.waiting) == (0, 0)
+        scheduler._slots.release()
+        assert await scheduler.run(fast) == "done"
+
+    asyncio.run(scenario())
+
+
+def test_timed_out_generation_frees_its_slot():
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1, max_queue=0, timeout=0.05)
+
+        async def slow():
+            await asyncio.sleep(1)
+
+        with pytest.raises(asyncio.TimeoutError):
+            await scheduler.run(slow)
+        assert (scheduler.active, scheduler.waiting) == (0, 0)
+        assert not scheduler.is_full()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1, max_queue=1, timeout=5)
+        release = asyncio.Event()
+
+        async def generate():
+            await release.wait()
+
+        running = asyncio.create_task(scheduler.run(generate))
+        waiter = asyncio.create_task(scheduler.run(generate))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert (scheduler.active, scheduler.waiting) == (1, 0)
+        release.set()
+        await running
+
+    asyncio.run(scenario())
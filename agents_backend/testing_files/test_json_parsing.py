@@ -0,0 +1,67 @@
+# testing_files/test_json_parsing.py
+# Run from the agents_backend directory: python -m pytest testing_files/test_json_parsing.py
+import json
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.json_parsing import IncrementalObjectParser, parse_json_object
+
+REQUIRED = ("role", "role_description", "task_prompt")
+AGENT = {"role": "Sorter", "role_description": "Sorts lists, fast", "task_prompt": "Sort {the} list]"}
+
+
+def test_fenced_object_with_surrounding_text():
+    text = "Here you go:\n```json\n" + json.dumps(AGENT, indent=2) + "\n```\nAnything else?"
+    assert parse_json_object(text, REQUIRED) == AGENT
+
+
+def test_trailing_commas_are_dropped_but_commas_inside_strings_kept():
+    text = '{"role": "a,}", "tags": ["x", "y",], "nested": {"k": ",]",},}'
+    assert parse_json_object(text) == {"role": "a,}", "tags": ["x", "y"], "nested": {"k": ",]"}}
+
+
+def test_truncated_value_is_not_accepted():
+    # task_prompt is cut off mid-word: returning it would store a half-written prompt.
+    text = '{"role": "Sorter", "role_description": "Sorts", "task_prompt": "Sort the li'
+    with pytest.raises(ValueError):
+        parse_json_object(text, REQUIRED)
+
+
+def test_truncation_after_the_required_fields_keeps_the_complete_ones():
+    text = '{"role": "Sorter", "role_description": "Sorts", "task_prompt": "Sort", "notes": "half wr'
+    assert parse_json_object(text, REQUIRED) == {"role": "Sorter", "role_description": "Sorts", "task_prompt": "Sort"}
+
+
+@pytest.mark.parametrize("text", ['{"a": 1, "b":', '{"a": 1, "b"', '{"a": 1, "b": [1, 2', '{"a": 1,'])
+def test_dangling_key_is_dropped(text):
+    assert parse_json_object(text) == {"a": 1}
+    with pytest.raises(ValueError):
+        parse_json_object(text, required=("a", "b"))
+
+
+def test_no_object_raises():
+    with pytest.raises(ValueError):
+        parse_json_object("I cannot help with that.")
+
+
+def test_incremental_parser_across_every_chunk_boundary():
+    text = 'noise {"role": "Sorter", "tags": ["a,b", {"c": "}"}], "task_prompt": "say \\"hi\\""} tail'
+    expected = [("role", "Sorter"), ("tags", ["a,b", {"c": "}"}]), ("task_prompt", 'say "hi"')]
+    for split in range(1, len(text)):
+        parser = IncrementalObjectParser()
+        fields = parser.feed(text[:split]) + parser.feed(text[split:])
+        assert fields == expected, split
+        assert parser.done
+
+
+def test_incremental_parser_one_character_at_a_time():
+    text = json.dumps(AGENT)
+    parser = IncrementalObjectParser()
+    fields = []
+    for ch in text:
+        fields.extend(parser.feed(ch))
+    assert dict(fields) == AGENT
+    assert parser.done
@@ -0,0 +1,73 @@
+# testing_files/test_lookup_cache.py
+# Run from the agents_backend directory: python -m pytest testing_files/test_lookup_cache.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import lookup_cache
+from db.lookup_cache import LookupCache, MISS
+
+
+class Clock:
+    # Stands in for time.monotonic so expiry can be stepped through.
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _cache(monkeypatch, max_size=3, ttl=60, negative_ttl=5):
+    clock = Clock()
+    monkeypatch.setattr(lookup_cache.time, "monotonic", clock)
+    return LookupCache(max_size, ttl, negative_ttl), clock
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    cache, clock = _cache(monkeypatch)
+    cache.put("a", {"elementId": "1"})
+    clock.now += 59
+    assert cache.get("a") == {"elementId": "1"}
+    clock.now += 2
+    assert cache.get("a") is MISS
+    assert cache.stats()["size"] == 0
+
+
+def test_negative_entries_use_the_shorter_ttl(monkeypatch):
+    cache, clock = _cache(monkeypatch)
+    cache.put("none", None)
+    cache.put("agent", {"elementId": "1"})
+    clock.now += 4
+    assert cache.get("none") is None
+    clock.now += 2
+    assert cache.get("none") is MISS
+    assert cache.get("agent") == {"elementId": "1"}
+    assert (cache.hits, cache.negative_hits, cache.misses) == (1, 1, 1)
+
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    cache, _ = _cache(monkeypatch)
+    for key in "abc":
+        cache.put(key, {"elementId": key})
+    cache.get("a")              # "b" is now the least recently used.
+    cache.put("d", {"elementId": "d"})
+    assert cache.get("b") is MISS
+    assert [cache.get(key)["elementId"] for key in "acd"] == ["a", "c", "d"]
+    assert cache.stats()["size"] == 3
+
+
+def test_invalidate_negatives_keeps_matches(monkeypatch):
+    cache, _ = _cache(monkeypatch)
+    cache.put("none", None)
+    cache.put("agent", {"elementId": "1"})
+    cache.invalidate_negatives()
+    assert cache.get("none") is MISS
+    assert cache.get("agent") == {"elementId": "1"}
+
+
+def test_zero_size_disables_the_cache(monkeypatch):
+    cache, _ = _cache(monkeypatch, max_size=0)
+    cache.put("a", {"elementId": "1"})
+    assert cache.get("a") is MISS
+    assert cache.stats()["size"] == 0
@@ -0,0 +1,93 @@
+# testing_files/test_outbox.py
+# Run from the agents_backend directory: python -m pytest testing_files/test_outbox.py
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import outbox as outbox_module
+from db.outbox import IndexOutbox
+
+
+class Clock:
+    # Stands in for time.time so leases and backoff can be stepped through.
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(outbox_module.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def outbox(tmp_path, clock):
+    outbox = IndexOutbox(str(tmp_path / "outbox.sqlite3"), lease_seconds=30.0, max_backoff=60.0)
+    yield outbox
+    outbox.close()
+
+
+def _agents(*ids):
+    return [{"elementId": element_id, "role": "r"} for element_id in ids]
+
+
+def test_claim_leases_entries_until_the_lease_expires(outbox, clock):
+    outbox.enqueue(_agents("a", "b", "c"))
+    first = outbox.claim(2)
+    assert [agent["elementId"] for _, _, agent in first] == ["a", "b"]
+    assert [agent["elementId"] for _, _, agent in outbox.claim(10)] == ["c"]
+    assert outbox.claim(10) == []
+
+    clock.now += 31
+    assert sorted(agent["elementId"] for _, _, agent in outbox.claim(10)) == ["a", "b", "c"]
+
+
+def test_complete_removes_entries(outbox):
+    outbox.enqueue(_agents("a", "b"))
+    entries = outbox.claim(10)
+    outbox.complete([row_id for row_id, _, _ in entries])
+    assert outbox.stats()["pending"] == 0
+
+
+def test_fail_retries_with_backoff(outbox, clock):
+    outbox.enqueue(_agents("a"))
+    [(row_id, _, _)] = outbox.claim(10)
+    outbox.fail([row_id], RuntimeError("chroma down"))
+    assert outbox.stats()["failing"] == 1
+    clock.now += 0.4
+    assert outbox.claim(10) == []
+    clock.now += 0.2                # First backoff is 0.5s.
+    [(retried, _, _)] = outbox.claim(10)
+    outbox.fail([retried], RuntimeError("chroma down"))
+    clock.now += 0.9
+    assert outbox.claim(10) == []   # Second backoff is 1s.
+    clock.now += 0.2
+    assert len(outbox.claim(10)) == 1
+
+
+def test_defer_does_not_count_as_a_failure(outbox, clock):
+    outbox.enqueue(_agents("a"))
+    [(row_id, _, _)] = outbox.claim(10)
+    outbox.defer([row_id], 5)
+    assert outbox.stats()["failing"] == 0
+    clock.now += 4
+    assert outbox.claim(10) == []
+    clock.now += 2
+    assert len(outbox.claim(10)) == 1
+
+
+def test_completing_a_stale_lease_keeps_the_newer_payload(outbox):
+    outbox.enqueue([{"elementId": "a", "role": "old"}])
+    [(stale_id, _, _)] = outbox.claim(10)
+    outbox.enqueue([{"elementId": "a", "role": "new"}])
+    outbox.complete([stale_id])
+    outbox.fail([stale_id], RuntimeError("late"))
+    [(_, _, agent)] = outbox.claim(10)
+    assert agent["role"] == "new"
+    assert outbox.stats() == {"pending": 1, "failing": 0, "oldest_age": 0.0}
@@ -0,0 +1,82 @@
+# testing_files/test_vector_index.py
+# Run from the agents_backend directory: python -m pytest testing_files/test_vector_index.py
+import os
+import sys
+import uuid
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import vector_index
+from db.vector_index import create_vector_index, load_index_from_collection
+
+DIM = 32
+
+
+@pytest.fixture
+def chroma_db(tmp_path, monkeypatch):
+    from db import chroma_db as chroma_db_module
+    monkeypatch.setattr(chroma_db_module, "EMBEDDING_CACHE_ENABLED", False)
+    manager = chroma_db_module.ChromaDBManager(embedding_function=None, path=str(tmp_path / "chroma_db"))
+    yield manager
+    manager.close()
+
+
+def _unit(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def stored(chroma_db):
+    rng = np.random.default_rng(7)
+    vectors = _unit(rng.standard_normal((300, DIM)).astype(np.float32))
+    agents = [
+        {"elementId": str(uuid.uuid4()), "role": f"Role {index}", "role_description": "d", "task_prompt": "t",
+         "problem_statement": f"problem {index}", "creation_timestamp": index}
+        for index in range(len(vectors))
+    ]
+    chroma_db.store_agents(agents, vectors.tolist())
+    # Near copies of stored agents (should match) and unrelated vectors (should not).
+    near = _unit(vectors[:40] + 0.15 * rng.standard_normal((40, DIM)).astype(np.float32))
+    far = _unit(rng.standard_normal((40, DIM)).astype(np.float32))
+    return np.vstack([near, far]).tolist()
+
+
+def _matches(chroma_db, queries):
+    results = chroma_db._query(queries)
+    return [chroma_db._best_match(results, position, "query") for position in range(len(queries))]
+
+
+@pytest.mark.parametrize("mode", ["flat", "hnsw"])
+def test_mirror_matches_chroma_top1(chroma_db, stored, mode):
+    if mode == "hnsw" and vector_index.hnswlib is None:
+        pytest.skip("hnswlib is not installed")
+    expected = _matches(chroma_db, stored)
+    assert any(match is not None for match in expected)
+    assert any(match is None for match in expected)
+
+    index = create_vector_index(mode, chroma_db.agents_collection.count(), hnsw_threshold=0)
+    load_index_from_collection(index, chroma_db.agents_collection)
+    chroma_db.vector_index = index
+    assert _matches(chroma_db, stored) == expected
+
+
+@pytest.mark.parametrize("mode", ["flat", "hnsw"])
+def test_mirror_distances_match_chroma(chroma_db, stored, mode):
+    if mode == "hnsw" and vector_index.hnswlib is None:
+        pytest.skip("hnswlib is not installed")
+    chroma = chroma_db.agents_collection.query(query_embeddings=stored, n_results=1)
+    index = create_vector_index(mode, chroma_db.agents_collection.count(), hnsw_threshold=0)
+    load_index_from_collection(index, chroma_db.agents_collection)
+    for expected, hits in zip(chroma["distances"], index.search(stored, k=1)):
+        assert hits[0][1] == pytest.approx(expected[0], abs=1e-4)
+
+
+def test_flat_index_remove_keeps_remaining_rows():
+    index = create_vector_index("flat", 0, hnsw_threshold=0)
+    vectors = np.eye(4, dtype=np.float32)
+    index.add(["a", "b", "c", "d"], vectors, [{}] * 4)
+    index.remove(["b"])
+    assert len(index) == 3
+    assert [hits[0][0] for hits in index.search(vectors[[0, 2, 3]])] == ["a", "c", "d"]